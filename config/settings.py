@@ -32,8 +32,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "inbox.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "inbox.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -85,12 +86,28 @@ DATABASES = {
     }
 }
 
+# Persistent connection pool (psycopg_pool), shared by each process's threads
+DB_POOL_MAX_SIZE = config("DB_POOL_MAX_SIZE", default=10, cast=int)
+if DB_POOL_MAX_SIZE:
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": config("DB_POOL_MIN_SIZE", default=2, cast=int),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": config("DB_POOL_TIMEOUT", default=10, cast=int),
+        },
+    }
+
 # Cache (Redis)
 
+REDIS_URL = config("REDIS_URL", default="redis://localhost:6380/0")
+# Connections per process for the async Redis client; under ASGI requests
+# beyond this wait for a free connection instead of failing
+REDIS_ASYNC_MAX_CONNECTIONS = config("REDIS_ASYNC_MAX_CONNECTIONS", default=50, cast=int)
+
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.redis.RedisCache",
-        "LOCATION": config("REDIS_URL", default="redis://localhost:6380/0"),
+        "LOCATION": REDIS_URL,
     }
 }
 
@@ -121,6 +138,26 @@ STORAGES = {
     },
 }
 
+# Blob storage for raw messages and large bodies (see inbox/blobs.py).
+# Local directory by default; set BLOB_S3_BUCKET to use S3-compatible storage
+# (requires django-storages[s3], credentials come from the AWS_* environment).
+
+BLOB_S3_BUCKET = config("BLOB_S3_BUCKET", default="")
+if BLOB_S3_BUCKET:
+    STORAGES["blobs"] = {
+        "BACKEND": "storages.backends.s3.S3Storage",
+        "OPTIONS": {
+            "bucket_name": BLOB_S3_BUCKET,
+            "endpoint_url": config("BLOB_S3_ENDPOINT_URL", default=None),
+            "location": config("BLOB_S3_PREFIX", default="blobs"),
+        },
+    }
+else:
+    STORAGES["blobs"] = {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        "OPTIONS": {"location": config("BLOB_ROOT", default=str(BASE_DIR / "blobs"))},
+    }
+
 # Default primary key field type
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
@@ -129,4 +166,64 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 MAIL_DOMAIN = config("MAIL_DOMAIN", default="voidmail.local")
 MAILBOX_TTL_MINUTES = config("MAILBOX_TTL_MINUTES", default=60, cast=int)
+INBOX_PAGE_SIZE = config("INBOX_PAGE_SIZE", default=50, cast=int)
 SMTP_PORT = config("SMTP_PORT", default=2525, cast=int)
+
+# Mint signed addresses on the home page and only create the mailbox row
+# when its first email arrives
+LAZY_MAILBOXES = config("LAZY_MAILBOXES", default=False, cast=bool)
+
+# Random addresses kept ready per active domain for new mailboxes (0 disables)
+ADDRESS_POOL_SIZE = config("ADDRESS_POOL_SIZE", default=500, cast=int)
+
+# Largest accepted message in bytes, advertised via ESMTP SIZE
+MAX_MESSAGE_SIZE = config("MAX_MESSAGE_SIZE", default=10 * 1024 * 1024, cast=int)
+
+# Total attachment bytes kept per mailbox; attachments past it are dropped
+# (the email itself is still stored)
+MAILBOX_ATTACHMENT_QUOTA = config("MAILBOX_ATTACHMENT_QUOTA", default=25 * 1024 * 1024, cast=int)
+
+# Keep the raw message for "view source", and move bodies larger than
+# BLOB_BODY_THRESHOLD bytes out of the inbox_email table into blob storage
+STORE_RAW_MESSAGES = config("STORE_RAW_MESSAGES", default=True, cast=bool)
+BLOB_BODY_THRESHOLD = config("BLOB_BODY_THRESHOLD", default=16 * 1024, cast=int)
+
+# Drop a message whose Message-ID is already stored in the receiving mailbox
+# (sender retries, duplicate deliveries); the sender still gets a 250
+DEDUPLICATE_MESSAGE_IDS = config("DEDUPLICATE_MESSAGE_IDS", default=True, cast=bool)
+
+# Active domains are cached in-process; check the shared version key every
+# DOMAIN_CACHE_POLL_SECONDS and reload unconditionally after DOMAIN_CACHE_TTL.
+DOMAIN_CACHE_POLL_SECONDS = config("DOMAIN_CACHE_POLL_SECONDS", default=2, cast=int)
+DOMAIN_CACHE_TTL = config("DOMAIN_CACHE_TTL", default=300, cast=int)
+
+# Incoming mail is stored in micro-batches of up to SMTP_WRITE_BATCH_SIZE
+# recipients, waiting at most SMTP_WRITE_BATCH_DELAY_MS for a batch to fill.
+SMTP_WRITE_BATCH_SIZE = config("SMTP_WRITE_BATCH_SIZE", default=200, cast=int)
+SMTP_WRITE_BATCH_DELAY_MS = config("SMTP_WRITE_BATCH_DELAY_MS", default=5, cast=int)
+
+# Worker processes parsing MIME off the SMTP event loop (0 parses inline)
+SMTP_PARSE_WORKERS = config("SMTP_PARSE_WORKERS", default=2, cast=int)
+
+# SMTP admission control (0 disables a limit). Sessions past SMTP_MAX_SESSIONS
+# get a 421, and so do all new sessions while the database writer is behind:
+# SMTP_MAX_PENDING_WRITES messages queued, or the oldest queued for
+# SMTP_MAX_WRITE_DELAY_MS; MAIL FROM gets a 451 meanwhile.
+SMTP_MAX_SESSIONS = config("SMTP_MAX_SESSIONS", default=1000, cast=int)
+SMTP_MAX_PENDING_WRITES = config("SMTP_MAX_PENDING_WRITES", default=2000, cast=int)
+SMTP_MAX_WRITE_DELAY_MS = config("SMTP_MAX_WRITE_DELAY_MS", default=2000, cast=int)
+
+# Per client IP token buckets for new sessions and messages: refill rate per
+# minute and burst size. Off by default, since a single ESP IP can send bursts
+# of verification mail. With SMTP_RATE_LIMIT_SHARED the buckets live in Redis
+# and are shared by all SMTP workers instead of being per process.
+SMTP_CLIENT_CONNECTIONS_PER_MINUTE = config("SMTP_CLIENT_CONNECTIONS_PER_MINUTE", default=0, cast=int)
+SMTP_CLIENT_CONNECTION_BURST = config("SMTP_CLIENT_CONNECTION_BURST", default=60, cast=int)
+SMTP_CLIENT_MESSAGES_PER_MINUTE = config("SMTP_CLIENT_MESSAGES_PER_MINUTE", default=0, cast=int)
+SMTP_CLIENT_MESSAGE_BURST = config("SMTP_CLIENT_MESSAGE_BURST", default=200, cast=int)
+SMTP_RATE_LIMIT_SHARED = config("SMTP_RATE_LIMIT_SHARED", default=False, cast=bool)
+
+# Width of each inbox_email partition, and how many future partitions to
+# keep ready, once the table is converted with `email_partitions --convert`
+EMAIL_PARTITION_HOURS = config("EMAIL_PARTITION_HOURS", default=1, cast=int)
+EMAIL_PARTITIONS_AHEAD = config("EMAIL_PARTITIONS_AHEAD", default=3, cast=int)
@@ -0,0 +1,89 @@
+"""Pre-generated ``(address, token)`` pairs for instant mailbox creation.
+
+A periodic task keeps a Redis list per active domain topped up with random
+addresses already checked against the database, so creating a mailbox is one
+``LPOP`` plus one insert. When the pool is empty or Redis is down, mailboxes
+fall back to generating their address inline.
+"""
+
+import logging
+
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import Domain, Mailbox, generate_local_part, generate_token
+from .redis_client import get_async_redis, get_redis
+
+logger = logging.getLogger("voidmail.address_pool")
+
+KEY_PREFIX = "voidmail:address-pool:"
+
+
+def pool_key(domain_id):
+    return f"{KEY_PREFIX}{domain_id}"
+
+
+async def apop(domain):
+    """Take an ``(address, token)`` pair for ``domain``, or None if the pool is empty."""
+    try:
+        entry = await get_async_redis().lpop(pool_key(domain.id))
+    except redis.RedisError:
+        logger.warning("Could not take an address from the pool", exc_info=True)
+        return None
+    if entry is None:
+        return None
+    address, token = entry.decode().split(" ")
+    return address, token
+
+
+def _create(domain, pooled):
+    if pooled is not None:
+        address, token = pooled
+        try:
+            with transaction.atomic():
+                return Mailbox.objects.create(domain=domain, address=address, token=token)
+        except IntegrityError:
+            # Taken since it was pooled, e.g. by a custom-named mailbox
+            logger.info("Pooled address %s was taken, generating a new one", address)
+    return Mailbox.objects.create(domain=domain)
+
+
+async def acreate_mailbox(domain):
+    """Create a mailbox on ``domain``, using a pooled address when one is available."""
+    pooled = await apop(domain) if settings.ADDRESS_POOL_SIZE else None
+    return await sync_to_async(_create)(domain, pooled)
+
+
+def refill(domain, size=None):
+    """Top the pool for ``domain`` up to ``size`` entries. Returns the number added."""
+    size = settings.ADDRESS_POOL_SIZE if size is None else size
+    client = get_redis()
+    key = pool_key(domain.id)
+    missing = size - client.llen(key)
+    if missing <= 0:
+        return 0
+    domain_name = domain.name.lower()
+    candidates = {f"{generate_local_part()}@{domain_name}" for _ in range(missing)}
+    taken = set(Mailbox.objects.filter(address__in=candidates).values_list("address", flat=True))
+    entries = [f"{address} {generate_token()}" for address in candidates - taken]
+    if entries:
+        client.rpush(key, *entries)
+    return len(entries)
+
+
+def refill_all():
+    """Refill the pools of all active domains and drop those of inactive ones."""
+    if not settings.ADDRESS_POOL_SIZE:
+        return 0
+    added = 0
+    active = set()
+    for domain in Domain.objects.filter(is_active=True):
+        active.add(pool_key(domain.id))
+        added += refill(domain)
+    client = get_redis()
+    stale = [key for key in client.scan_iter(match=f"{KEY_PREFIX}*") if key.decode() not in active]
+    if stale:
+        client.delete(*stale)
+    return added
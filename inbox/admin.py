@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Domain, Email, Mailbox
+from .models import Attachment, Domain, Email, Mailbox
 
 
 @admin.register(Domain)
@@ -21,3 +21,9 @@ class MailboxAdmin(admin.ModelAdmin):
 class EmailAdmin(admin.ModelAdmin):
     list_display = ("sender", "recipient", "subject", "received_at", "size_bytes")
     list_filter = ("received_at",)
+
+
+@admin.register(Attachment)
+class AttachmentAdmin(admin.ModelAdmin):
+    list_display = ("filename", "content_type", "size_bytes", "mailbox")
+    raw_id_fields = ("mailbox", "email")
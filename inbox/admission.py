@@ -0,0 +1,184 @@
+"""Admission control for the SMTP server.
+
+New sessions are refused with a 421 once ``SMTP_MAX_SESSIONS`` are open, a
+client IP exceeds its connection rate, or the database writer has fallen
+behind (too many messages queued, or the oldest waiting too long). MAIL FROM
+gets a 451 when the client exceeds its message rate or the writer is behind.
+The server's ORM work all runs on asgiref's single database thread, so the
+writer's queue delay also measures how far behind that thread is.
+Senders retry temporary failures later, so under overload the server keeps
+storing mail at the rate the database sustains instead of queueing without
+bound.
+
+Rate limits are token buckets per client IP, kept in process or, with
+``SMTP_RATE_LIMIT_SHARED``, in Redis so all SMTP workers share them.
+"""
+
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+from . import metrics
+from .redis_client import get_async_redis
+
+logger = logging.getLogger("voidmail.admission")
+
+KEY_PREFIX = "voidmail:smtp-rate:"
+
+# Local buckets are pruned of idle clients once there are this many
+MAX_LOCAL_BUCKETS = 10_000
+
+# Seconds between warnings while Redis is unreachable
+REDIS_WARNING_INTERVAL = 60
+
+SERVICE_BUSY = "421 4.3.2 Service busy, try again later"
+TOO_MANY_CONNECTIONS = "421 4.7.0 Too many connections from your address, try again later"
+SYSTEM_BUSY = "451 4.3.2 System busy, try again later"
+TOO_MANY_MESSAGES = "451 4.7.1 Too many messages from your address, try again later"
+
+# KEYS[1] = bucket key; ARGV = tokens per second, burst, now
+_TAKE_SCRIPT = """
+local rate, burst, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens, updated = tonumber(bucket[1]), tonumber(bucket[2])
+if tokens == nil then
+    tokens, updated = burst, now
+end
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local taken = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    taken = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return taken
+"""
+
+
+class TokenBucket:
+    """Per-key token buckets refilling at ``per_minute``, holding at most ``burst`` tokens."""
+
+    def __init__(self, name, per_minute, burst):
+        self.name = name
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.buckets = {}
+
+    def take(self, key):
+        """Take a token for ``key``; False if its bucket is empty."""
+        now = time.monotonic()
+        if len(self.buckets) >= MAX_LOCAL_BUCKETS:
+            self._prune(now)
+        tokens, updated = self.buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return False
+        self.buckets[key] = (tokens - 1, now)
+        return True
+
+    def _prune(self, now):
+        # A bucket that has refilled completely is the same as no bucket
+        full = [
+            key for key, (tokens, updated) in self.buckets.items()
+            if tokens + (now - updated) * self.rate >= self.burst
+        ]
+        for key in full:
+            del self.buckets[key]
+
+    async def atake(self, key):
+        return self.take(key)
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token buckets in Redis, shared by all processes; in process while Redis is down."""
+
+    warned_at = None
+
+    async def atake(self, key):
+        client = get_async_redis()
+        try:
+            return bool(await client.register_script(_TAKE_SCRIPT)(
+                keys=[f"{KEY_PREFIX}{self.name}:{key}"], args=[self.rate, self.burst, time.time()],
+            ))
+        except redis.RedisError:
+            now = time.monotonic()
+            if self.warned_at is None or now - self.warned_at >= REDIS_WARNING_INTERVAL:
+                self.warned_at = now
+                logger.warning("Could not rate limit in Redis, limiting per process", exc_info=True)
+            return self.take(key)
+
+
+class Admission:
+    """Decides whether to serve new SMTP sessions and messages.
+
+    ``writer`` is the process's ``EmailWriter``; its backlog is the measure
+    of database load. A limit of 0 disables the corresponding check.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.sessions = 0
+        self.max_sessions = settings.SMTP_MAX_SESSIONS
+        self.max_pending_writes = settings.SMTP_MAX_PENDING_WRITES
+        self.max_write_delay = settings.SMTP_MAX_WRITE_DELAY_MS / 1000
+        bucket = SharedTokenBucket if settings.SMTP_RATE_LIMIT_SHARED else TokenBucket
+        self.connections = self.messages = None
+        if settings.SMTP_CLIENT_CONNECTIONS_PER_MINUTE:
+            self.connections = bucket(
+                "connections", settings.SMTP_CLIENT_CONNECTIONS_PER_MINUTE,
+                max(1, settings.SMTP_CLIENT_CONNECTION_BURST),
+            )
+        if settings.SMTP_CLIENT_MESSAGES_PER_MINUTE:
+            self.messages = bucket(
+                "messages", settings.SMTP_CLIENT_MESSAGES_PER_MINUTE, max(1, settings.SMTP_CLIENT_MESSAGE_BURST),
+            )
+
+    def overloaded(self):
+        """True while the database writer is too far behind to take more mail."""
+        waiting, delay = self.writer.backlog()
+        return bool(
+            (self.max_pending_writes and waiting >= self.max_pending_writes)
+            or (self.max_write_delay and delay >= self.max_write_delay)
+        )
+
+    async def admit_session(self, client):
+        """Return a 421 reply refusing a new session from ``client``, or None to serve it.
+
+        An admitted session is counted in ``sessions`` until ``end_session``.
+        """
+        if self.max_sessions and self.sessions >= self.max_sessions:
+            metrics.REJECTED_SESSIONS_FULL.inc()
+            return SERVICE_BUSY
+        if self.overloaded():
+            metrics.REJECTED_SESSION_OVERLOADED.inc()
+            return SERVICE_BUSY
+        # Hold the slot across the rate limit check, or sessions admitted
+        # while it awaits Redis could take the server past max_sessions
+        self.sessions += 1
+        try:
+            allowed = self.connections is None or await self.connections.atake(client)
+        except BaseException:
+            self.sessions -= 1
+            raise
+        if not allowed:
+            self.sessions -= 1
+            metrics.REJECTED_CONNECTION_RATE.inc()
+            return TOO_MANY_CONNECTIONS
+        return None
+
+    def end_session(self):
+        self.sessions -= 1
+
+    async def admit_message(self, client):
+        """Return a 451 reply deferring a message from ``client``, or None to accept MAIL FROM."""
+        if self.overloaded():
+            metrics.REJECTED_MESSAGE_OVERLOADED.inc()
+            return SYSTEM_BUSY
+        if self.messages is not None and not await self.messages.atake(client):
+            metrics.REJECTED_MESSAGE_RATE.inc()
+            return TOO_MANY_MESSAGES
+        return None
@@ -6,5 +6,8 @@ class InboxConfig(AppConfig):
     name = "inbox"
 
     def ready(self):
-        # Import tasks to register them with the scheduler
+        # metrics installs the per-request query recorder on new database
+        # connections; tasks registers them with the scheduler
+        import inbox.metrics  # noqa: F401
+        import inbox.signals  # noqa: F401
         import inbox.tasks  # noqa: F401
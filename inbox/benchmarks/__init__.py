@@ -0,0 +1,71 @@
+"""Benchmarks for VoidMail hot paths, run with ``manage.py benchmark``.
+
+Each scenario's ``run`` returns its results as a dict; ``--output`` saves
+them as JSON and ``--compare`` reports the changes against a saved run.
+"""
+
+import statistics
+
+from . import concurrency, expiry, explain, inbox, ingest, parse, polling, rcpt
+
+SCENARIOS = {
+    "rcpt": rcpt,
+    "parse": parse,
+    "inbox": inbox,
+    "explain": explain,
+    "expiry": expiry,
+    "polling": polling,
+    "concurrency": concurrency,
+    "ingest": ingest,
+}
+
+
+def percentile(samples, pct):
+    """Return the ``pct`` percentile of ``samples`` (nearest-rank)."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Summarize latency samples (seconds) in milliseconds."""
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.fmean(samples) * 1000 if samples else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+        "total_s": sum(samples),
+    }
+
+
+def format_row(label, stats, queries=None):
+    row = (
+        f"{label:<12} n={stats['count']:<7} mean={stats['mean_ms']:.3f}ms "
+        f"p50={stats['p50_ms']:.3f}ms p99={stats['p99_ms']:.3f}ms total={stats['total_s']:.2f}s"
+    )
+    if queries is not None:
+        row += f" queries={queries}"
+    return row
+
+
+def flatten(results, prefix=""):
+    """Return the numeric values of nested ``results`` keyed by dotted path."""
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def compare(baseline, results):
+    """Yield a line per numeric result that changed since ``baseline``."""
+    before, after = flatten(baseline), flatten(results)
+    for key, value in after.items():
+        if key not in before or before[key] == value:
+            continue
+        change = f" ({(value - before[key]) / before[key]:+.1%})" if before[key] else ""
+        yield f"{key:<40} {before[key]:.3f} -> {value:.3f}{change}"
@@ -0,0 +1,93 @@
+"""Polling latency and throughput of one web worker at increasing numbers of concurrent clients.
+
+Runs against a live server (``--url``), started with a single worker, e.g.
+``granian config.asgi:application --interface asgi --workers 1``. Clients
+behave like the inbox page: they poll ``check_emails`` every ``--interval``
+seconds, revalidating with the ETag they last got. To compare builds, run
+it against each one with the same options.
+"""
+
+import asyncio
+import time
+from collections import Counter
+
+from django.urls import reverse
+
+from inbox.benchmarks.http import parse_url, raise_open_file_limit
+from inbox.benchmarks.polling import poll_client
+from inbox.models import Domain, Mailbox
+
+BENCH_DOMAIN = "bench.voidmail.invalid"
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--url", default="http://127.0.0.1:8000",
+        help="Base URL of the running web server (default: http://127.0.0.1:8000)",
+    )
+    parser.add_argument(
+        "--levels", default="1000,5000",
+        help="Comma-separated numbers of concurrent clients to run, one after another (default: 1000,5000)",
+    )
+    parser.add_argument(
+        "--mailboxes", type=int, default=500,
+        help="Mailboxes the clients are spread over (default: 500)",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=1.0,
+        help="Seconds between polls per client (default: 1)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30.0,
+        help="Seconds to poll per level (default: 30)",
+    )
+
+
+async def _run_level(host, port, paths, clients, options):
+    stats = {"samples": [], "statuses": Counter(), "errors": 0}
+    deadline = time.monotonic() + options["duration"]
+    await asyncio.gather(*(
+        poll_client(host, port, paths, deadline, options["interval"], True, stats)
+        for _ in range(clients)
+    ))
+    return stats
+
+
+def run(command, options):
+    from inbox.benchmarks import format_row, summarize
+
+    host, port, prefix = parse_url(options["url"])
+    levels = [int(level) for level in options["levels"].split(",")]
+    limit = raise_open_file_limit()
+    if limit < max(levels) + 100:
+        command.stderr.write(f"Open file limit is {limit}; some of {max(levels)} clients will fail to connect")
+
+    domain, created = Domain.objects.get_or_create(name=BENCH_DOMAIN, defaults={"is_active": True})
+    mailboxes = [Mailbox.objects.create(domain=domain) for _ in range(options["mailboxes"])]
+    paths = [prefix + reverse("inbox:check_emails", kwargs={"token": mailbox.token}) for mailbox in mailboxes]
+
+    results = {}
+    try:
+        for clients in levels:
+            stats = asyncio.run(_run_level(host, port, paths, clients, options))
+            requests = sum(stats["statuses"].values())
+            label = f"{clients}-clients"
+            results[label] = {
+                **summarize(stats["samples"]),
+                "requests_per_s": requests / options["duration"],
+                # What the clients asked for if every poll were answered on time
+                "offered_per_s": clients / options["interval"],
+                "errors": stats["errors"],
+                "statuses": dict(stats["statuses"]),
+            }
+            row = format_row(label, results[label])
+            row += (
+                f" req/s={results[label]['requests_per_s']:.0f}"
+                f" (offered {results[label]['offered_per_s']:.0f}) errors={stats['errors']}"
+            )
+            command.stdout.write(row)
+    finally:
+        Mailbox.objects.filter(pk__in=[mailbox.pk for mailbox in mailboxes]).delete()
+        if created:
+            domain.delete()
+    return results
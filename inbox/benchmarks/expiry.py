@@ -0,0 +1,126 @@
+"""Delete a large backlog of expired mailboxes while measuring concurrent insert latency."""
+
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.utils import timezone
+
+from inbox import deletion
+from inbox.models import Domain, Email, Mailbox
+
+BENCH_DOMAIN = "bench.voidmail.invalid"
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--mailboxes", type=int, default=1_000_000,
+        help="Expired mailboxes to seed (default: 1000000)",
+    )
+    parser.add_argument(
+        "--emails-per-mailbox", type=int, default=5,
+        help="Emails to seed per expired mailbox (default: 5)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=deletion.DEFAULT_BATCH_SIZE,
+        help=f"Mailboxes per delete batch (default: {deletion.DEFAULT_BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--legacy", action="store_true",
+        help="Also time QuerySet.delete() on the same backlog (slow, memory hungry)",
+    )
+
+
+def _seed(domain, count, per_mailbox):
+    """Insert the expired backlog server-side; building millions of objects in Python is the slow part."""
+    expired = timezone.now() - timedelta(hours=1)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO inbox_mailbox (domain_id, address, token, created_at, expires_at)
+            SELECT %s, 'expired' || g || '@' || %s, 'bench-expired-' || g, %s, %s
+            FROM generate_series(1, %s) AS g
+            """,
+            [domain.id, BENCH_DOMAIN, expired, expired, count],
+        )
+        cursor.execute(
+            """
+            INSERT INTO inbox_email (
+                mailbox_id, sender, recipient, message_id, subject, snippet, body_text, body_html,
+                body_text_blob, body_html_blob, display_text, display_html, display_text_blob,
+                display_html_blob, render_version, raw_blob, received_at, size_bytes, is_deleted
+            )
+            SELECT m.id, 'bench@example.com', m.address, '', 'Benchmark', '', repeat('x', 512), '',
+                '', '', repeat('x', 512), '', '', '', 1, '', %s, 512, false
+            FROM inbox_mailbox AS m, generate_series(1, %s)
+            WHERE m.domain_id = %s AND m.expires_at <= %s
+            """,
+            [expired, per_mailbox, domain.id, expired],
+        )
+        cursor.execute("ANALYZE inbox_mailbox")
+        cursor.execute("ANALYZE inbox_email")
+
+
+def _insert_loop(mailbox, stop, samples):
+    """Keep inserting emails into a live mailbox, recording each insert's latency."""
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            Email.objects.create(mailbox=mailbox, sender="bench@example.com", recipient=mailbox.address)
+            samples.append(time.perf_counter() - start)
+    finally:
+        connections.close_all()
+
+
+def run(command, options):
+    from inbox.benchmarks import format_row, summarize
+
+    if connection.vendor != "postgresql":
+        raise CommandError("The expiry benchmark requires PostgreSQL")
+
+    domain, created = Domain.objects.get_or_create(name=BENCH_DOMAIN, defaults={"is_active": True})
+    live = Mailbox.objects.create(domain=domain)
+    expired = Mailbox.objects.filter(domain=domain, expires_at__lte=timezone.now())
+
+    variants = [("chunked", lambda: deletion.delete_mailboxes(expired, batch_size=options["batch_size"]))]
+    if options["legacy"]:
+        variants.append(("legacy", lambda: expired.delete()))
+
+    results = {}
+    try:
+        for label, delete in variants:
+            command.stdout.write(f"Seeding {options['mailboxes']} mailbox(es) for {label}...")
+            _seed(domain, options["mailboxes"], options["emails_per_mailbox"])
+
+            stop = threading.Event()
+            samples = []
+            inserter = threading.Thread(target=_insert_loop, args=(live, stop, samples))
+            inserter.start()
+            start = time.perf_counter()
+            try:
+                delete()
+            finally:
+                elapsed = time.perf_counter() - start
+                stop.set()
+                inserter.join()
+
+            results[label] = {
+                "delete_s": elapsed,
+                "mailboxes_per_s": options["mailboxes"] / elapsed,
+                "inserts": summarize(samples),
+                "max_insert_ms": max(samples, default=0.0) * 1000,
+            }
+            command.stdout.write(
+                f"{label:<12} deleted in {elapsed:.1f}s ({results[label]['mailboxes_per_s']:.0f} mailboxes/s)"
+            )
+            command.stdout.write(
+                format_row("  inserts", results[label]["inserts"])
+                + f" max={results[label]['max_insert_ms']:.1f}ms"
+            )
+    finally:
+        deletion.delete_mailboxes(Mailbox.objects.filter(domain=domain))
+        if created:
+            domain.delete()
+    return results
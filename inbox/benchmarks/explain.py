@@ -0,0 +1,96 @@
+"""Check that each hot query uses an index, via EXPLAIN on a seeded dataset."""
+
+import random
+from datetime import timedelta
+
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from inbox.models import Domain, Email, Mailbox
+
+BENCH_DOMAIN = "bench.voidmail.invalid"
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--mailboxes", type=int, default=20_000,
+        help="Mailboxes to seed (default: 20000)",
+    )
+    parser.add_argument(
+        "--emails-per-mailbox", type=int, default=5,
+        help="Emails to seed per mailbox (default: 5)",
+    )
+
+
+def hot_queries(mailbox, now):
+    """The queries issued on the ingest, web and cleanup paths, by label."""
+    from inbox.views import SUMMARY_FIELDS
+
+    visible = mailbox.emails.filter(is_deleted=False)
+    return {
+        "inbox list": ("inbox_email", visible.only(*SUMMARY_FIELDS)[:50]),
+        "poll since": ("inbox_email", visible.filter(received_at__gt=now - timedelta(minutes=5))[:50]),
+        "poll count": ("inbox_email", visible.values("id")),
+        "rcpt/ingest address": ("inbox_mailbox", Mailbox.objects.filter(address=mailbox.address, expires_at__gt=now)),
+        "inbox token": ("inbox_mailbox", Mailbox.objects.filter(token=mailbox.token)),
+        "cleanup expired": ("inbox_mailbox", Mailbox.objects.filter(expires_at__lte=now)),
+        "purge by age": ("inbox_mailbox", Mailbox.objects.filter(created_at__lte=now - timedelta(hours=1))),
+    }
+
+
+def seed(count, per_mailbox):
+    domain, _ = Domain.objects.get_or_create(name=BENCH_DOMAIN, defaults={"is_active": True})
+    now = timezone.now()
+    rng = random.Random(42)
+    mailboxes = Mailbox.objects.bulk_create(
+        Mailbox(
+            domain=domain,
+            address=f"bench{i}@{BENCH_DOMAIN}",
+            token=f"bench-{i}",
+            # Mostly live, a few percent already expired
+            expires_at=now + timedelta(minutes=rng.randint(-3, 60)),
+        )
+        for i in range(count)
+    )
+    Email.objects.bulk_create(
+        (
+            Email(
+                mailbox=mailbox, sender="bench@example.com", recipient=mailbox.address,
+                subject="Benchmark", is_deleted=rng.random() < 0.1,
+            )
+            for mailbox in mailboxes
+            for _ in range(per_mailbox)
+        ),
+        batch_size=5000,
+    )
+    return mailboxes[rng.randrange(count)], now
+
+
+def run(command, options):
+    if connection.vendor != "postgresql":
+        raise CommandError("The explain benchmark requires PostgreSQL")
+
+    results = {}
+    # Everything is seeded inside a transaction that is rolled back at the end
+    with transaction.atomic():
+        mailbox, now = seed(options["mailboxes"], options["emails_per_mailbox"])
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE inbox_mailbox")
+            cursor.execute("ANALYZE inbox_email")
+
+        for label, (table, queryset) in hot_queries(mailbox, now).items():
+            plan = queryset.explain()
+            uses_index = "Index" in plan and f"Seq Scan on {table}" not in plan
+            results[label] = {"uses_index": uses_index, "plan": plan}
+            status = command.style.SUCCESS("index") if uses_index else command.style.ERROR("SEQ SCAN")
+            command.stdout.write(f"{label:<22} {status}")
+            if not uses_index or options["verbosity"] > 1:
+                command.stdout.write("    " + plan.replace("\n", "\n    "))
+
+        transaction.set_rollback(True)
+
+    missing = [label for label, result in results.items() if not result["uses_index"]]
+    if missing:
+        raise CommandError(f"Queries not using an index: {', '.join(missing)}")
+    return results
@@ -0,0 +1,96 @@
+"""Minimal keep-alive HTTP/1.1 client for driving many concurrent connections.
+
+Only what the load scenarios need: plain-HTTP GET with Content-Length or
+chunked responses. A thread or an HTTP library per client would not scale to
+thousands of simultaneous pollers on one machine.
+"""
+
+import asyncio
+import resource
+from urllib.parse import urlsplit
+
+from django.core.management.base import CommandError
+
+
+def parse_url(url):
+    """Return ``(host, port, path prefix)`` for a plain-HTTP base URL."""
+    parts = urlsplit(url)
+    if parts.scheme != "http":
+        raise CommandError(f"Only http:// URLs are supported, got {url!r}")
+    return parts.hostname, parts.port or 80, parts.path.rstrip("/")
+
+
+def raise_open_file_limit():
+    """Raise the soft file descriptor limit to the hard limit. Returns the new limit."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+class Connection:
+    """One persistent connection, reopened whenever the server closes it."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def get(self, path, headers=None):
+        """Send a GET and return ``(status, headers, body)``."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"GET {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        try:
+            await self.writer.drain()
+            status, response_headers = await self._read_head()
+            body = await self._read_body(status, response_headers)
+        except (OSError, asyncio.IncompleteReadError):
+            await self.close()
+            raise
+        if response_headers.get("connection", "").lower() == "close":
+            await self.close()
+        return status, response_headers, body
+
+    async def _read_head(self):
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        return int(status_line.split()[1]), headers
+
+    async def _read_body(self, status, headers):
+        if status == 304 or status == 204 or 100 <= status < 200:
+            return b""
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    return b"".join(chunks)
+                chunks.append(chunk[:-2])
+        if "content-length" in headers:
+            return await self.reader.readexactly(int(headers["content-length"]))
+        body = await self.reader.read()
+        await self.close()
+        return body
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
@@ -0,0 +1,80 @@
+"""Inbox render time for a mailbox full of large messages: full rows vs summary columns."""
+
+import time
+
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from inbox.models import Domain, Email, Mailbox
+
+BENCH_DOMAIN = "bench.voidmail.invalid"
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--emails", type=int, default=500,
+        help="Emails in the benchmark mailbox (default: 500)",
+    )
+    parser.add_argument(
+        "--body-size", type=int, default=200 * 1024,
+        help="Bytes of body_text and body_html per email (default: 200KB)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=20,
+        help="Renders per variant (default: 20)",
+    )
+
+
+def _legacy_render(mailbox):
+    # The pre-summary implementation: every column of every email, unpaginated
+    emails = list(mailbox.emails.filter(is_deleted=False))
+    return render_to_string("inbox/inbox.html", {
+        "mailbox": mailbox,
+        "page": {"object_list": emails, "paginator": {"count": len(emails)}},
+        "remaining_seconds": 0,
+        "domains": Domain.objects.filter(is_active=True),
+        "local_part": mailbox.address.split("@")[0],
+    })
+
+
+def run(command, options):
+    from inbox.benchmarks import format_row, summarize
+
+    domain, created = Domain.objects.get_or_create(name=BENCH_DOMAIN, defaults={"is_active": True})
+    mailbox = Mailbox.objects.create(domain=domain)
+    body = "x" * options["body_size"]
+    Email.objects.bulk_create(
+        Email(
+            mailbox=mailbox, sender="bench@example.com", recipient=mailbox.address,
+            subject=f"Benchmark {i}", snippet=body[:160], body_text=body, body_html=body,
+            size_bytes=2 * len(body),
+        )
+        for i in range(options["emails"])
+    )
+
+    client = Client(HTTP_HOST="localhost")
+    url = reverse("inbox:inbox_view", kwargs={"token": mailbox.token})
+    variants = (
+        ("full-rows", lambda: _legacy_render(mailbox)),
+        ("summary", lambda: client.get(url)),
+    )
+    results = {}
+    try:
+        for label, render in variants:
+            samples = []
+            with CaptureQueriesContext(connection) as ctx:
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    render()
+                    samples.append(time.perf_counter() - start)
+            queries = len(ctx.captured_queries) // options["repeat"]
+            results[label] = {**summarize(samples), "queries": queries}
+            command.stdout.write(format_row(label, results[label], queries))
+    finally:
+        mailbox.delete()
+        if created:
+            domain.delete()
+    return results
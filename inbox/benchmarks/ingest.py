@@ -0,0 +1,375 @@
+"""End-to-end SMTP ingest throughput, optionally with browsers polling at the same time.
+
+Starts ``manage.py smtpserver`` as a subprocess against the configured
+database and Redis and sends it generated mail over ``--connections``
+concurrent SMTP sessions. With ``--pollers``, clients poll ``check_emails``
+of the receiving mailboxes on a live web server (``--url``) meanwhile.
+Reports messages per second, per-message latency (MAIL FROM to the DATA
+reply), database queries per message from the server's own metrics and
+the resident memory of the server and its parse workers.
+"""
+
+import asyncio
+import os
+import random
+import signal
+import smtplib
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.urls import reverse
+from prometheus_client.parser import text_string_to_metric_families
+
+from inbox.benchmarks.http import parse_url, raise_open_file_limit
+from inbox.benchmarks.parse import build_message
+from inbox.benchmarks.polling import poll_client
+from inbox.models import Domain, Mailbox
+
+BENCH_DOMAIN = "bench.voidmail.invalid"
+
+# Seconds to wait for the server to come up and to shut down
+SERVER_START_TIMEOUT = 60
+SERVER_STOP_TIMEOUT = 40
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--messages", type=int, default=5000,
+        help="Messages to send (default: 5000)",
+    )
+    parser.add_argument(
+        "--connections", type=int, default=50,
+        help="Concurrent SMTP sessions (default: 50)",
+    )
+    parser.add_argument(
+        "--messages-per-connection", type=int, default=10,
+        help="Messages sent per SMTP session before reconnecting (default: 10)",
+    )
+    parser.add_argument(
+        "--sizes", default="2048:70,20480:25,262144:5",
+        help="Message body size distribution as size:weight pairs (default: 2048:70,20480:25,262144:5)",
+    )
+    parser.add_argument(
+        "--recipients", default="1:85,2:10,5:5",
+        help="Recipients per message distribution as count:weight pairs (default: 1:85,2:10,5:5)",
+    )
+    parser.add_argument(
+        "--unknown-ratio", type=float, default=0.1,
+        help="Fraction of recipients without a mailbox (default: 0.1)",
+    )
+    parser.add_argument(
+        "--mailboxes", type=int, default=500,
+        help="Mailboxes mail is delivered to (default: 500)",
+    )
+    parser.add_argument(
+        "--smtp-workers", type=int, default=1,
+        help="SMTP worker processes (default: 1)",
+    )
+    parser.add_argument(
+        "--parse-workers", type=int, default=None,
+        help="MIME parse processes per SMTP worker (default: SMTP_PARSE_WORKERS from settings)",
+    )
+    parser.add_argument(
+        "--port", type=int, default=2625,
+        help="Port for the benchmarked SMTP server (default: 2625)",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=9625,
+        help="Metrics port of the benchmarked SMTP server (default: 9625)",
+    )
+    parser.add_argument(
+        "--pollers", type=int, default=0,
+        help="Browsers polling check_emails during the run, 0 for none (default: 0)",
+    )
+    parser.add_argument(
+        "--url", default="http://127.0.0.1:8000",
+        help="Base URL of the running web server the pollers use (default: http://127.0.0.1:8000)",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=5.0,
+        help="Seconds between polls per poller, as in the inbox page (default: 5)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=42,
+        help="Random seed for the generated traffic (default: 42)",
+    )
+    parser.add_argument(
+        "--client-rate-limits", action="store_true",
+        help="Keep the server's per-client rate limits; off by default since all traffic comes from one IP",
+    )
+
+
+def _distribution(option, spec):
+    """Parse ``value:weight,...`` into ``(values, weights)``."""
+    values, weights = [], []
+    try:
+        for pair in spec.split(","):
+            value, _, weight = pair.partition(":")
+            values.append(int(value))
+            weights.append(float(weight or 1))
+    except ValueError:
+        raise CommandError(f"--{option} must be value:weight pairs, got {spec!r}")
+    return values, weights
+
+
+def _traffic(options, addresses):
+    """Build ``(recipients, payload)`` for every message to send."""
+    rng = random.Random(options["seed"])
+    sizes, size_weights = _distribution("sizes", options["sizes"])
+    counts, count_weights = _distribution("recipients", options["recipients"])
+    bodies = {size: build_message(size) for size in sizes}
+    traffic = []
+    for size, count in zip(
+        rng.choices(sizes, size_weights, k=options["messages"]),
+        rng.choices(counts, count_weights, k=options["messages"]),
+    ):
+        recipients = [
+            f"nobody-{rng.getrandbits(48):x}@{BENCH_DOMAIN}"
+            if rng.random() < options["unknown_ratio"] else rng.choice(addresses)
+            for _ in range(count)
+        ]
+        # Each message gets its own Message-ID
+        payload = f"Message-ID: <{uuid.uuid4().hex}@{BENCH_DOMAIN}>\r\n".encode() + bodies[size]
+        traffic.append((recipients, payload))
+    return traffic
+
+
+def _session(port, messages):
+    """Send ``messages`` over one SMTP session, recording each message's latency."""
+    stats = {"samples": [], "replies": Counter(), "errors": 0}
+    try:
+        client = smtplib.SMTP("127.0.0.1", port)
+    except smtplib.SMTPConnectError as exc:
+        # Session refused (421): every message in it is deferred
+        stats["replies"][f"{exc.smtp_code // 100}xx"] += len(messages)
+        return stats
+    except OSError:
+        stats["errors"] = len(messages)
+        return stats
+    try:
+        client.ehlo()
+        for index, (recipients, payload) in enumerate(messages):
+            start = time.perf_counter()
+            try:
+                client.sendmail("bench@example.com", recipients, payload)
+            except smtplib.SMTPRecipientsRefused:
+                stats["replies"]["rejected"] += 1
+            except smtplib.SMTPResponseException as exc:
+                stats["replies"][f"{exc.smtp_code // 100}xx"] += 1
+            except (smtplib.SMTPException, OSError):
+                stats["errors"] += len(messages) - index
+                return stats
+            else:
+                stats["samples"].append(time.perf_counter() - start)
+                stats["replies"]["2xx"] += 1
+        client.quit()
+    finally:
+        client.close()
+    return stats
+
+
+def _tree_rss(pid):
+    """Resident bytes of ``pid`` and its descendants, or None without /proc."""
+    proc = Path("/proc")
+    if not (proc / str(pid)).exists():
+        return None
+    children = {}
+    for stat in proc.glob("[0-9]*/stat"):
+        try:
+            # The command name may contain spaces; fields after it are fixed
+            fields = stat.read_text().rpartition(")")[2].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(stat.parent.name))
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            status = (proc / str(current) / "status").read_text()
+        except OSError:
+            continue
+        for line in status.splitlines():
+            if line.startswith("VmRSS:"):
+                total += int(line.split()[1]) * 1024
+    return total
+
+
+def _scrape(port):
+    """Return ``{(sample name, labels): value}`` from a metrics endpoint."""
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=10) as response:
+        text = response.read().decode()
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+def _delta(before, after, name, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    return after.get(key, 0.0) - before.get(key, 0.0)
+
+
+def _start_server(options, metrics_dir, log):
+    command = [
+        sys.executable, str(Path(settings.BASE_DIR) / "manage.py"), "smtpserver",
+        "--host", "127.0.0.1", "--port", str(options["port"]),
+        "--workers", str(options["smtp_workers"]), "--metrics-port", str(options["metrics_port"]),
+    ]
+    if options["parse_workers"] is not None:
+        command += ["--parse-workers", str(options["parse_workers"])]
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": metrics_dir}
+    if not options["client_rate_limits"]:
+        # Otherwise the token buckets of 127.0.0.1, not ingest, set the pace
+        env.update(SMTP_CLIENT_CONNECTIONS_PER_MINUTE="0", SMTP_CLIENT_MESSAGES_PER_MINUTE="0")
+    server = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            break
+        try:
+            with socket.create_connection(("127.0.0.1", options["port"]), timeout=1) as sock:
+                if sock.recv(3) == b"220":
+                    return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    _stop_server(server)
+    log.seek(0)
+    raise CommandError(f"smtpserver did not start:\n{log.read().decode(errors='replace')}")
+
+
+def _stop_server(server):
+    if server.poll() is None:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(SERVER_STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            server.kill()
+            server.wait()
+
+
+async def _run(server, traffic, poll_paths, options):
+    loop = asyncio.get_running_loop()
+    poll_stats = {"samples": [], "statuses": Counter(), "errors": 0}
+    rss = []
+
+    async def sample_rss():
+        while True:
+            rss.append(await loop.run_in_executor(None, _tree_rss, server.pid))
+            await asyncio.sleep(0.5)
+
+    host, port, _ = parse_url(options["url"])
+    background = [asyncio.create_task(sample_rss())]
+    background += [
+        asyncio.create_task(poll_client(host, port, poll_paths, float("inf"), options["interval"], True, poll_stats))
+        for _ in range(options["pollers"])
+    ]
+
+    per_session = options["messages_per_connection"]
+    sessions = [traffic[i:i + per_session] for i in range(0, len(traffic), per_session)]
+    clients = ThreadPoolExecutor(options["connections"])
+    start = time.perf_counter()
+    try:
+        sessions = await asyncio.gather(*(
+            loop.run_in_executor(clients, _session, options["port"], messages) for messages in sessions
+        ))
+        elapsed = time.perf_counter() - start
+        rss.append(await loop.run_in_executor(None, _tree_rss, server.pid))
+    finally:
+        clients.shutdown(wait=False, cancel_futures=True)
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+
+    stats = {"samples": [], "replies": Counter(), "errors": 0}
+    for session in sessions:
+        stats["samples"] += session["samples"]
+        stats["replies"] += session["replies"]
+        stats["errors"] += session["errors"]
+    return elapsed, stats, poll_stats, [value for value in rss if value is not None]
+
+
+def run(command, options):
+    from inbox.benchmarks import format_row, summarize
+
+    if options["pollers"]:
+        limit = raise_open_file_limit()
+        if limit < options["pollers"] + options["connections"] + 100:
+            command.stderr.write(f"Open file limit is {limit}; some of {options['pollers']} pollers will fail to connect")
+
+    domain, created = Domain.objects.get_or_create(name=BENCH_DOMAIN, defaults={"is_active": True})
+    mailboxes = [Mailbox.objects.create(domain=domain) for _ in range(options["mailboxes"])]
+    prefix = parse_url(options["url"])[2]
+    poll_paths = [prefix + reverse("inbox:check_emails", kwargs={"token": mailbox.token}) for mailbox in mailboxes]
+    traffic = _traffic(options, [mailbox.address for mailbox in mailboxes])
+
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as metrics_dir, tempfile.TemporaryFile() as log:
+            # Started after seeding so the server's mailbox index knows the mailboxes
+            server = _start_server(options, metrics_dir, log)
+            try:
+                before = _scrape(options["metrics_port"])
+                elapsed, stats, poll_stats, rss = asyncio.run(_run(server, traffic, poll_paths, options))
+                after = _scrape(options["metrics_port"])
+            finally:
+                _stop_server(server)
+
+        accepted = _delta(before, after, "voidmail_smtp_messages_total", reply="2xx")
+        results["ingest"] = {
+            **summarize(stats["samples"]),
+            "messages_per_s": stats["replies"]["2xx"] / elapsed,
+            "replies": dict(stats["replies"]),
+            "errors": stats["errors"],
+            "recipients_stored": _delta(before, after, "voidmail_smtp_recipients_total", outcome="stored"),
+            "recipients_discarded": _delta(before, after, "voidmail_smtp_recipients_total", outcome="discarded"),
+            "recipients_rejected": _delta(before, after, "voidmail_smtp_recipients_total", outcome="rejected"),
+            "received_mb": _delta(before, after, "voidmail_smtp_received_bytes_total") / 2**20,
+            "queries_per_message": (
+                _delta(before, after, "voidmail_db_queries_total") / accepted if accepted else None
+            ),
+            "server_rss_peak_mb": max(rss) / 2**20 if rss else None,
+            "server_rss_end_mb": rss[-1] / 2**20 if rss else None,
+        }
+        ingest = results["ingest"]
+        row = format_row("ingest", ingest)
+        row += f" msg/s={ingest['messages_per_s']:.0f} errors={ingest['errors']}"
+        if ingest["queries_per_message"] is not None:
+            row += f" queries/msg={ingest['queries_per_message']:.2f}"
+        if rss:
+            row += f" rss_peak={ingest['server_rss_peak_mb']:.0f}MB"
+        command.stdout.write(row)
+
+        if options["pollers"]:
+            requests = sum(poll_stats["statuses"].values())
+            results["polling"] = {
+                **summarize(poll_stats["samples"]),
+                "requests_per_s": requests / elapsed,
+                "not_modified": poll_stats["statuses"][304],
+                "errors": poll_stats["errors"],
+                "statuses": dict(poll_stats["statuses"]),
+            }
+            row = format_row("polling", results["polling"])
+            row += (
+                f" req/s={results['polling']['requests_per_s']:.0f}"
+                f" 304={poll_stats['statuses'][304]} errors={poll_stats['errors']}"
+            )
+            command.stdout.write(row)
+    finally:
+        Mailbox.objects.filter(pk__in=[mailbox.pk for mailbox in mailboxes]).delete()
+        if created:
+            domain.delete()
+    return results
@@ -0,0 +1,118 @@
+"""SMTP session latency with a mix of small and large messages, inline vs process-pool parsing."""
+
+import asyncio
+import email.policy
+import multiprocessing
+import random
+import smtplib
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from email.message import EmailMessage
+
+from aiosmtpd.smtp import SMTP as SMTPServer
+
+BENCH_DOMAIN = "bench.voidmail.invalid"
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--messages", type=int, default=500,
+        help="Messages to send per variant (default: 500)",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=20,
+        help="Concurrent SMTP sessions (default: 20)",
+    )
+    parser.add_argument(
+        "--large-ratio", type=float, default=0.05,
+        help="Fraction of messages that are large (default: 0.05)",
+    )
+    parser.add_argument(
+        "--small-size", type=int, default=5 * 1024,
+        help="Body size of small messages in bytes (default: 5KB)",
+    )
+    parser.add_argument(
+        "--large-size", type=int, default=5 * 1024 * 1024,
+        help="Body size of large messages in bytes (default: 5MB)",
+    )
+    parser.add_argument(
+        "--parse-workers", type=int, default=4,
+        help="Worker processes for the process-pool variant (default: 4)",
+    )
+
+
+def build_message(size):
+    msg = EmailMessage()
+    msg["From"] = "bench@example.com"
+    msg["To"] = f"user@{BENCH_DOMAIN}"
+    msg["Subject"] = f"Benchmark message ({size} bytes)"
+    line = "The quick brown fox jumps over the lazy dog. " * 2 + "\n"
+    msg.set_content(line * (size // len(line) + 1))
+    msg.add_alternative(f"<html><body><pre>{line * 10}</pre></body></html>", subtype="html")
+    return msg.as_bytes(policy=email.policy.SMTP)
+
+
+class _NullWriter:
+    async def submit(self, message):
+        return message.recipients
+
+
+def _send(port, payload):
+    start = time.perf_counter()
+    with smtplib.SMTP("127.0.0.1", port) as client:
+        client.sendmail("bench@example.com", [f"user@{BENCH_DOMAIN}"], payload)
+    return time.perf_counter() - start
+
+
+async def _run_variant(executor, payloads, concurrency):
+    from inbox.management.commands.smtpserver import VoidMailHandler
+
+    class Handler(VoidMailHandler):
+        async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+            envelope.rcpt_tos.append(address)
+            return "250 OK"
+
+    loop = asyncio.get_running_loop()
+    handler = Handler(domains=frozenset([BENCH_DOMAIN]), writer=_NullWriter(), executor=executor)
+    server = await loop.create_server(lambda: SMTPServer(handler, loop=loop), "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    clients = ThreadPoolExecutor(concurrency)
+    try:
+        return await asyncio.gather(*(
+            loop.run_in_executor(clients, _send, port, payload) for _, payload in payloads
+        ))
+    finally:
+        server.close()
+        # Don't block the loop: client threads may still be talking to the server
+        clients.shutdown(wait=False, cancel_futures=True)
+
+
+def run(command, options):
+    from inbox.benchmarks import format_row, summarize
+
+    rng = random.Random(42)
+    small, large = build_message(options["small_size"]), build_message(options["large_size"])
+    payloads = [
+        ("large", large) if rng.random() < options["large_ratio"] else ("small", small)
+        for _ in range(options["messages"])
+    ]
+
+    results = {}
+    variants = (
+        ("inline", lambda: None),
+        ("pool", lambda: ProcessPoolExecutor(
+            options["parse_workers"], mp_context=multiprocessing.get_context("spawn"),
+        )),
+    )
+    for label, make_executor in variants:
+        executor = make_executor()
+        try:
+            samples = asyncio.run(_run_variant(executor, payloads, options["concurrency"]))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        small_samples = [s for (kind, _), s in zip(payloads, samples) if kind == "small"]
+        results[label] = {"all": summarize(samples), "small": summarize(small_samples)}
+        command.stdout.write(format_row(f"{label}/all", results[label]["all"]))
+        command.stdout.write(format_row(f"{label}/small", results[label]["small"]))
+    return results
@@ -0,0 +1,156 @@
+"""Database load from many concurrent inbox pollers, with and without ETag revalidation.
+
+Runs against a live web server (``--url``), so start one first, for example
+``granian config.asgi:application --interface asgi``. Thousands of clients
+need a matching open-file limit on both sides; the benchmark raises its own
+soft limit to the hard limit.
+"""
+
+import asyncio
+import random
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.urls import reverse
+
+from inbox.benchmarks.http import Connection, parse_url, raise_open_file_limit
+from inbox.ingest import IncomingMessage, write_batch
+from inbox.models import Domain, Mailbox
+
+BENCH_DOMAIN = "bench.voidmail.invalid"
+
+# PostgreSQL flushes backend statistics at most about every 10 seconds when idle
+PG_STATS_SETTLE_SECONDS = 11
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--url", default="http://127.0.0.1:8000",
+        help="Base URL of the running web server (default: http://127.0.0.1:8000)",
+    )
+    parser.add_argument(
+        "--clients", type=int, default=10000,
+        help="Concurrent polling clients (default: 10000)",
+    )
+    parser.add_argument(
+        "--mailboxes", type=int, default=1000,
+        help="Mailboxes the clients are spread over (default: 1000)",
+    )
+    parser.add_argument(
+        "--interval", type=float, default=5.0,
+        help="Seconds between polls per client, as in the inbox page (default: 5)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=60.0,
+        help="Seconds to poll per variant (default: 60)",
+    )
+    parser.add_argument(
+        "--mail-rate", type=float, default=2.0,
+        help="Emails delivered per second to random mailboxes during the run (default: 2)",
+    )
+
+
+def _db_transactions():
+    """Committed plus rolled back transactions on this database, or None if not PostgreSQL.
+
+    Outside ``atomic`` blocks every query is its own transaction, so this
+    tracks the query count.
+    """
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_stat_clear_snapshot()")
+        cursor.execute(
+            "SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database()"
+        )
+        return cursor.fetchone()[0]
+
+
+async def poll_client(host, port, paths, deadline, interval, use_etag, stats):
+    """Poll one random path every ``interval`` seconds over a keep-alive connection."""
+    conn = Connection(host, port)
+    path = random.choice(paths)
+    etag = None
+    await asyncio.sleep(random.uniform(0, interval))
+    try:
+        while time.monotonic() < deadline:
+            headers = {"If-None-Match": etag} if use_etag and etag else None
+            start = time.perf_counter()
+            try:
+                status, response_headers, _ = await conn.get(path, headers)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                stats["errors"] += 1
+            else:
+                stats["samples"].append(time.perf_counter() - start)
+                stats["statuses"][status] += 1
+                etag = response_headers.get("etag", etag)
+            await asyncio.sleep(interval)
+    finally:
+        await conn.close()
+
+
+async def _deliver(mailboxes, rate, deadline):
+    store = sync_to_async(write_batch)
+    while time.monotonic() < deadline:
+        await asyncio.sleep(1 / rate)
+        mailbox = random.choice(mailboxes)
+        await store([IncomingMessage(
+            sender="bench@example.com", subject="Polling benchmark", snippet="",
+            size_bytes=0, recipients=[mailbox.address],
+        )])
+
+
+async def _run_variant(host, port, paths, mailboxes, options, use_etag):
+    stats = {"samples": [], "statuses": Counter(), "errors": 0}
+    deadline = time.monotonic() + options["duration"]
+    tasks = [
+        poll_client(host, port, paths, deadline, options["interval"], use_etag, stats)
+        for _ in range(options["clients"])
+    ]
+    if options["mail_rate"] > 0:
+        tasks.append(_deliver(mailboxes, options["mail_rate"], deadline))
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def run(command, options):
+    from inbox.benchmarks import format_row, summarize
+
+    host, port, prefix = parse_url(options["url"])
+    limit = raise_open_file_limit()
+    if limit < options["clients"] + 100:
+        command.stderr.write(f"Open file limit is {limit}; some of {options['clients']} clients will fail to connect")
+
+    domain, created = Domain.objects.get_or_create(name=BENCH_DOMAIN, defaults={"is_active": True})
+    mailboxes = [Mailbox.objects.create(domain=domain) for _ in range(options["mailboxes"])]
+    paths = [prefix + reverse("inbox:check_emails", kwargs={"token": mailbox.token}) for mailbox in mailboxes]
+
+    results = {}
+    try:
+        for label, use_etag in (("no-etag", False), ("etag", True)):
+            before = _db_transactions()
+            stats = asyncio.run(_run_variant(host, port, paths, mailboxes, options, use_etag))
+            if before is not None:
+                time.sleep(PG_STATS_SETTLE_SECONDS)
+            after = _db_transactions()
+            requests = sum(stats["statuses"].values())
+            results[label] = {
+                **summarize(stats["samples"]),
+                "requests_per_s": requests / options["duration"],
+                "not_modified": stats["statuses"][304],
+                "errors": stats["errors"],
+                "statuses": dict(stats["statuses"]),
+                "db_qps": None if before is None else (after - before) / options["duration"],
+            }
+            row = format_row(label, results[label])
+            row += f" req/s={results[label]['requests_per_s']:.0f} 304={stats['statuses'][304]} errors={stats['errors']}"
+            if before is not None:
+                row += f" db_qps={results[label]['db_qps']:.1f}"
+            command.stdout.write(row)
+    finally:
+        Mailbox.objects.filter(pk__in=[mailbox.pk for mailbox in mailboxes]).delete()
+        if created:
+            domain.delete()
+    return results
@@ -0,0 +1,71 @@
+"""RCPT acceptance latency and DB queries: per-recipient query vs domain cache."""
+
+import time
+
+from aiosmtpd.smtp import Envelope, Session
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from inbox import mailbox_index
+from inbox.domains import DomainRegistry
+from inbox.models import Domain, Mailbox
+
+BENCH_DOMAIN = "bench.voidmail.invalid"
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--recipients", type=int, default=10_000,
+        help="Number of RCPT commands to issue per variant (default: 10000)",
+    )
+
+
+async def _legacy_rcpt(address):
+    # The pre-cache implementation: one EXISTS query per recipient
+    domain = address.split("@")[-1].lower()
+    return await Domain.objects.filter(name__iexact=domain, is_active=True).aexists()
+
+
+async def _time_rcpts(check, addresses):
+    samples = []
+    for address in addresses:
+        start = time.perf_counter()
+        await check(address)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run(command, options):
+    from inbox.benchmarks import format_row, summarize
+    from inbox.management.commands.smtpserver import VoidMailHandler
+
+    count = options["recipients"]
+    addresses = [f"user{i}@{BENCH_DOMAIN}" for i in range(count)]
+    domain, created = Domain.objects.get_or_create(name=BENCH_DOMAIN, defaults={"is_active": True})
+    # Live mailboxes, so every RCPT is accepted and the index answers each one
+    Mailbox.objects.bulk_create(
+        [Mailbox(address=address, domain=domain) for address in addresses], batch_size=1000,
+    )
+    mailbox_index.rebuild()
+
+    handler = VoidMailHandler(DomainRegistry())
+    handler.domains.refresh(force=True)
+    server, session = None, Session(loop=None)
+
+    async def cached_rcpt(address):
+        return await handler.handle_RCPT(server, session, Envelope(), address, [])
+
+    results = {}
+    try:
+        for label, check in (("database", _legacy_rcpt), ("cache", cached_rcpt)):
+            with CaptureQueriesContext(connection) as ctx:
+                samples = async_to_sync(_time_rcpts)(check, addresses)
+            results[label] = {**summarize(samples), "queries": len(ctx.captured_queries)}
+            command.stdout.write(format_row(label, results[label], len(ctx.captured_queries)))
+    finally:
+        Mailbox.objects.filter(address__in=addresses).delete()
+        mailbox_index.remove(*addresses)
+        if created:
+            domain.delete()
+    return results
@@ -0,0 +1,114 @@
+"""Content-addressed storage for raw messages and large bodies.
+
+Blobs live in the ``blobs`` storage from ``STORAGES`` (the local filesystem by
+default, or any Django storage such as django-storages' S3Storage) under
+``ab/cd/<sha256>``, with a ``.gz`` suffix when stored compressed. The storage
+name doubles as the blob key kept on the ``Email`` row, so identical content
+is only ever written once.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.utils import timezone
+
+logger = logging.getLogger("voidmail.blobs")
+
+COMPRESSED_SUFFIX = ".gz"
+
+
+def get_storage():
+    return storages["blobs"]
+
+
+def blob_key(digest, compress=True):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}" + (COMPRESSED_SUFFIX if compress else "")
+
+
+def _save(storage, key, data, compress):
+    payload = gzip.compress(data, compresslevel=6, mtime=0) if compress else data
+    saved = storage.save(key, ContentFile(payload))
+    if saved != key:
+        # Lost a race with another writer storing the same content
+        storage.delete(saved)
+
+
+def _touch(storage, key, data, compress):
+    """Make an existing blob look just written, so garbage collection keeps it."""
+    try:
+        os.utime(storage.path(key))
+    except (NotImplementedError, FileNotFoundError):
+        # Storages without local paths only update the time by writing again,
+        # and a blob collected since the existence check must be written anyway
+        _save(storage, key, data, compress)
+
+
+def put(data, compress=True):
+    """Store ``data`` and return its key.
+
+    Content that is already stored is not written again, but its modified
+    time is refreshed: ``collect_garbage`` only spares unreferenced blobs
+    within the grace period, and the new reference may not be committed yet.
+    """
+    key = blob_key(hashlib.sha256(data).hexdigest(), compress)
+    storage = get_storage()
+    if storage.exists(key):
+        _touch(storage, key, data, compress)
+    else:
+        _save(storage, key, data, compress)
+    return key
+
+
+def open_blob(key):
+    """Open a blob for reading its original (decompressed) bytes."""
+    f = get_storage().open(key, "rb")
+    if key.endswith(COMPRESSED_SUFFIX):
+        return gzip.GzipFile(fileobj=f, mode="rb")
+    return f
+
+
+def read(key):
+    with open_blob(key) as f:
+        return f.read()
+
+
+def read_text(key):
+    return read(key).decode("utf-8")
+
+
+def _walk(storage, path=""):
+    try:
+        directories, files = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield f"{path}/{name}" if path else name
+    for directory in directories:
+        yield from _walk(storage, f"{path}/{directory}" if path else directory)
+
+
+def collect_garbage(referenced, grace=timedelta(hours=1)):
+    """Delete blobs not in ``referenced`` that are older than ``grace``.
+
+    The grace period protects blobs written for messages whose rows are not
+    committed yet. Returns the number of blobs deleted.
+    """
+    storage = get_storage()
+    cutoff = timezone.now() - grace
+    deleted = 0
+    for key in _walk(storage):
+        if key in referenced:
+            continue
+        try:
+            if storage.get_modified_time(key) > cutoff:
+                continue
+            storage.delete(key)
+        except FileNotFoundError:
+            continue
+        deleted += 1
+    return deleted
@@ -0,0 +1,101 @@
+"""Chunked deletion of mailboxes and their emails.
+
+``QuerySet.delete()`` collects every matching mailbox and cascaded email into
+memory and deletes them in one long transaction. Here each batch is a single
+statement in its own short transaction: lock up to ``batch_size`` matching
+mailboxes (skipping rows a concurrent insert holds), delete their emails and
+attachments, then the mailboxes themselves, all on the database side.
+"""
+
+import logging
+import time
+from dataclasses import dataclass, field
+
+from django.db import connection, transaction
+
+from . import mailbox_index, mailbox_versions, metrics
+from .models import Attachment, Email, Mailbox
+
+logger = logging.getLogger("voidmail.deletion")
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+@dataclass
+class DeletionStats:
+    mailboxes: int = 0
+    emails: int = 0
+    batches: int = 0
+    timed_out: bool = False
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def __str__(self):
+        rate = self.mailboxes / self.elapsed if self.elapsed else 0.0
+        return (
+            f"{self.mailboxes} mailbox(es) and {self.emails} email(s) in {self.batches} batch(es), "
+            f"{self.elapsed:.1f}s ({rate:.0f} mailboxes/s)"
+        )
+
+
+def _batch_sql(queryset, batch_size):
+    batch = queryset.order_by("pk").values("pk").select_for_update(skip_locked=True)[:batch_size]
+    select_sql, params = batch.query.sql_with_params()
+    quote = connection.ops.quote_name
+    return f"""
+        WITH batch (id) AS ({select_sql}),
+        deleted_emails AS (
+            DELETE FROM {quote(Email._meta.db_table)}
+            WHERE mailbox_id IN (SELECT id FROM batch)
+            RETURNING 1
+        ),
+        deleted_attachments AS (
+            DELETE FROM {quote(Attachment._meta.db_table)}
+            WHERE mailbox_id IN (SELECT id FROM batch)
+        )
+        DELETE FROM {quote(Mailbox._meta.db_table)}
+        WHERE id IN (SELECT id FROM batch)
+        RETURNING address, token, (SELECT count(*) FROM deleted_emails)
+    """, params
+
+
+def delete_mailboxes(queryset, batch_size=DEFAULT_BATCH_SIZE, throttle=0, progress=None, max_runtime=None):
+    """Delete the mailboxes in ``queryset`` and their emails in bounded batches.
+
+    Sleeps ``throttle`` seconds between batches to leave room for other
+    writers, and calls ``progress(stats)`` after each one. Stops early, with
+    ``timed_out`` set, once ``max_runtime`` seconds have passed. Deleted
+    addresses are dropped from the Redis caches, since no signals are sent.
+    Returns a ``DeletionStats``.
+    """
+    stats = DeletionStats()
+    while True:
+        with transaction.atomic():
+            sql, params = _batch_sql(queryset, batch_size)
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+        if not rows:
+            break
+
+        mailbox_index.remove(*(address for address, _, _ in rows))
+        mailbox_versions.deleted(*(token for _, token, _ in rows))
+        stats.mailboxes += len(rows)
+        stats.emails += rows[0][2]
+        metrics.DELETE_BATCH_MAILBOXES.observe(len(rows))
+        metrics.DELETED_MAILBOXES.inc(len(rows))
+        metrics.DELETED_EMAILS.inc(rows[0][2])
+        stats.batches += 1
+        if progress is not None:
+            progress(stats)
+        if len(rows) < batch_size:
+            break
+        if max_runtime is not None and stats.elapsed >= max_runtime:
+            stats.timed_out = True
+            break
+        if throttle:
+            time.sleep(throttle)
+    return stats
@@ -0,0 +1,119 @@
+"""In-process registry of active domains."""
+
+import asyncio
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Domain
+
+logger = logging.getLogger("voidmail.domains")
+
+VERSION_KEY = "voidmail:domains:version"
+
+
+def get_version():
+    """Return the shared domain version, or None if Redis is unreachable."""
+    try:
+        return cache.get(VERSION_KEY, 0)
+    except Exception:
+        logger.warning("Could not read domain version from cache", exc_info=True)
+        return None
+
+
+def bump_version():
+    """Tell every process that the domain table changed."""
+    try:
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, timeout=None)
+    except Exception:
+        logger.warning("Could not bump domain version in cache", exc_info=True)
+
+
+class DomainRegistry:
+    """Active domains held in memory.
+
+    Reloaded from the database when the shared version key changes (bumped on
+    every ``Domain`` save/delete) or once ``ttl`` seconds have passed, so
+    membership tests and the views' domain lookups never touch the database.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = settings.DOMAIN_CACHE_TTL if ttl is None else ttl
+        self.active = ()
+        self.names = frozenset()
+        self.by_id = {}
+        self.by_name = {}
+        self.default = None
+        self.version = None
+        self.loaded_at = None
+        self.checked_at = None
+
+    def __contains__(self, name):
+        return name.lower() in self.names
+
+    def get(self, domain_id):
+        """Return the active domain with ``domain_id`` (an int or numeric string), or None."""
+        try:
+            return self.by_id.get(int(domain_id))
+        except (TypeError, ValueError):
+            return None
+
+    def get_by_name(self, name):
+        return self.by_name.get(name.lower())
+
+    def is_stale(self, version):
+        if self.loaded_at is None or version is None or version != self.version:
+            return True
+        return time.monotonic() - self.loaded_at >= self.ttl
+
+    def refresh(self, force=False):
+        """Reload the active domains if stale. Returns True if reloaded."""
+        version = get_version()
+        self.checked_at = time.monotonic()
+        if not force and not self.is_stale(version):
+            return False
+        active = tuple(Domain.objects.filter(is_active=True).order_by("name"))
+        self.active = active
+        self.names = frozenset(domain.name.lower() for domain in active)
+        self.by_id = {domain.id: domain for domain in active}
+        self.by_name = {domain.name.lower(): domain for domain in active}
+        # The default domain, falling back to the first active one
+        self.default = next((domain for domain in active if domain.is_default), active[0] if active else None)
+        self.version = version
+        self.loaded_at = time.monotonic()
+        logger.debug("Loaded %d active domain(s)", len(active))
+        return True
+
+    def refresh_if_due(self):
+        """Refresh at most every ``DOMAIN_CACHE_POLL_SECONDS``; for request handlers."""
+        if self.checked_at is None or time.monotonic() - self.checked_at >= settings.DOMAIN_CACHE_POLL_SECONDS:
+            self.refresh()
+        return self
+
+    async def arefresh(self, force=False):
+        return await sync_to_async(self.refresh)(force)
+
+    async def arefresh_if_due(self):
+        if self.checked_at is None or time.monotonic() - self.checked_at >= settings.DOMAIN_CACHE_POLL_SECONDS:
+            await self.arefresh()
+        return self
+
+    async def run(self, interval=None):
+        """Keep the cache fresh until cancelled."""
+        interval = settings.DOMAIN_CACHE_POLL_SECONDS if interval is None else interval
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.arefresh()
+            except Exception:
+                logger.exception("Failed to refresh active domains")
+
+
+# Shared by the views and, in the SMTP server, kept fresh by ``run``
+registry = DomainRegistry()
@@ -0,0 +1,96 @@
+"""New-mail notifications over Redis pub/sub, for the inbox event stream.
+
+The ingest path publishes one message per stored email on a per-mailbox
+channel. Each web process holds a single pattern subscription and fans
+messages out to the event streams open in that process, so an idle stream
+costs neither database queries nor its own Redis connection.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+from collections import defaultdict
+
+import redis
+
+from .redis_client import get_async_redis, get_redis
+
+logger = logging.getLogger("voidmail.events")
+
+CHANNEL_PREFIX = "voidmail:mailbox:"
+
+# Seconds between keepalive comments on an idle stream
+KEEPALIVE_SECONDS = 15
+
+
+def channel(token):
+    return f"{CHANNEL_PREFIX}{token}"
+
+
+def email_payload(email):
+    return {
+        "id": email.id,
+        "sender": email.sender,
+        "subject": email.subject,
+        "received_at": email.received_at.isoformat(),
+    }
+
+
+def publish_new_emails(notifications):
+    """Publish ``(mailbox token, Email)`` pairs in one round trip."""
+    if not notifications:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for token, email in notifications:
+            pipe.publish(channel(token), json.dumps(email_payload(email)))
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning("Could not publish %d new-mail notification(s)", len(notifications), exc_info=True)
+
+
+class MailboxEventHub:
+    """Fans out new-mail notifications to the streams open in this process."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.listener = None
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, token):
+        """Yield a queue receiving JSON payloads for ``token``'s new emails."""
+        queue = asyncio.Queue(maxsize=100)
+        self.subscribers[token].add(queue)
+        self._ensure_listener()
+        try:
+            yield queue
+        finally:
+            self.subscribers[token].discard(queue)
+            if not self.subscribers[token]:
+                del self.subscribers[token]
+
+    def _ensure_listener(self):
+        loop = asyncio.get_running_loop()
+        if self.listener is None or self.listener.done() or self.listener.get_loop() is not loop:
+            self.listener = loop.create_task(self._listen())
+
+    def _dispatch(self, message):
+        token = message["channel"].decode()[len(CHANNEL_PREFIX):]
+        for queue in self.subscribers.get(token, ()):
+            with contextlib.suppress(asyncio.QueueFull):
+                queue.put_nowait(message["data"].decode())
+
+    async def _listen(self):
+        while True:
+            try:
+                async with get_async_redis().pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+                    async for message in pubsub.listen():
+                        self._dispatch(message)
+            except redis.RedisError:
+                logger.warning("Lost new-mail subscription, reconnecting", exc_info=True)
+                await asyncio.sleep(1)
+
+
+hub = MailboxEventHub()
@@ -0,0 +1,266 @@
+"""Batched database writes for incoming mail."""
+
+import asyncio
+import collections
+import logging
+import time
+from dataclasses import dataclass, field
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import blobs, events, lazy_mailboxes, mailbox_versions
+from .models import Attachment, Email, Mailbox
+
+logger = logging.getLogger("voidmail.ingest")
+
+
+@dataclass
+class IncomingMessage:
+    sender: str
+    subject: str
+    snippet: str
+    size_bytes: int
+    recipients: list
+    message_id: str = ""
+    body_text: str = ""
+    body_html: str = ""
+    body_text_blob: str = ""
+    body_html_blob: str = ""
+    display_text: str = ""
+    display_html: str = ""
+    display_text_blob: str = ""
+    display_html_blob: str = ""
+    render_version: int = 0
+    raw_blob: str = ""
+    # Attachment fields (filename, content_type, size_bytes, blob) per file
+    attachments: list = field(default_factory=list)
+
+
+def offload_bodies(copies=1, **bodies):
+    """Move bodies to blob storage when their ``copies`` would exceed ``BLOB_BODY_THRESHOLD``.
+
+    Returns the ``Email`` fields to store for each ``name=text``: the body is
+    either kept in the row or replaced by a blob key in ``<name>_blob``.
+    ``copies`` is the number of rows that will store the fields; blobs are
+    content-addressed, so a message fanned out to many mailboxes has its
+    bodies written once and shared by all its rows.
+    """
+    fields = {}
+    for name, text in bodies.items():
+        encoded = text.encode("utf-8")
+        if len(encoded) * copies > settings.BLOB_BODY_THRESHOLD:
+            fields[name], fields[f"{name}_blob"] = "", blobs.put(encoded)
+        else:
+            fields[name], fields[f"{name}_blob"] = text, ""
+    return fields
+
+
+def offload(raw, attachments=(), copies=1, **bodies):
+    """Write the raw message, attachments and oversized bodies to blob storage.
+
+    Returns the ``Email`` body fields to store (see ``offload_bodies``), plus
+    the stored ``attachments`` for ``IncomingMessage``.
+    """
+    fields = offload_bodies(copies, **bodies)
+    fields["raw_blob"] = blobs.put(raw) if settings.STORE_RAW_MESSAGES else ""
+    # Uncompressed, so downloads stream straight from storage
+    fields["attachments"] = [
+        {
+            "filename": attachment.filename,
+            "content_type": attachment.content_type,
+            "size_bytes": len(attachment.data),
+            "blob": blobs.put(attachment.data, compress=False),
+        }
+        for attachment in attachments
+        if len(attachment.data) <= settings.MAILBOX_ATTACHMENT_QUOTA
+    ]
+    return fields
+
+
+def _attachments(emails, messages):
+    """Attachment rows for newly stored emails, within each mailbox's quota."""
+    wanted = [(email, entry) for email, message in zip(emails, messages) for entry in message.attachments]
+    if not wanted:
+        return []
+    used = dict(
+        Attachment.objects.filter(mailbox_id__in={email.mailbox_id for email, _ in wanted})
+        .values("mailbox_id").annotate(total=Sum("size_bytes")).values_list("mailbox_id", "total")
+    )
+    rows = []
+    for email, entry in wanted:
+        total = used.get(email.mailbox_id, 0) + entry["size_bytes"]
+        if total > settings.MAILBOX_ATTACHMENT_QUOTA:
+            logger.info("Dropped attachment %s for %s: over the mailbox quota", entry["filename"], email.recipient)
+            continue
+        used[email.mailbox_id] = total
+        rows.append(Attachment(mailbox_id=email.mailbox_id, email=email, **entry))
+    return rows
+
+
+def _seen_message_ids(messages, mailboxes):
+    """``(mailbox id, Message-ID)`` pairs of the batch already stored, deleted ones included."""
+    message_ids = {message.message_id for message in messages if message.message_id}
+    if not message_ids:
+        return set()
+    return set(
+        Email.objects.filter(
+            mailbox_id__in={mailbox_id for mailbox_id, _ in mailboxes.values()}, message_id__in=message_ids,
+        ).values_list("mailbox_id", "message_id")
+    )
+
+
+def write_batch(messages):
+    """Store a batch of messages with one mailbox query and one insert per table.
+
+    Lazy mailboxes receiving their first email get their row created here.
+    Returns, for each message, the recipients that had a live mailbox.
+    """
+    addresses = {recipient.lower() for message in messages for recipient in message.recipients}
+    mailboxes = {
+        address: (mailbox_id, token)
+        for address, mailbox_id, token in Mailbox.objects.filter(
+            address__in=addresses, expires_at__gt=timezone.now(),
+        ).values_list("address", "id", "token")
+    }
+    if settings.LAZY_MAILBOXES:
+        for address, mailbox in lazy_mailboxes.materialize(addresses - mailboxes.keys()).items():
+            mailboxes[address] = (mailbox.id, mailbox.token)
+    seen = _seen_message_ids(messages, mailboxes) if settings.DEDUPLICATE_MESSAGE_IDS else None
+
+    emails = []
+    sources = []
+    tokens = []
+    stored = []
+    for message in messages:
+        delivered = []
+        for recipient in message.recipients:
+            if recipient.lower() not in mailboxes:
+                continue
+            mailbox_id, token = mailboxes[recipient.lower()]
+            if seen is not None and message.message_id:
+                if (mailbox_id, message.message_id) in seen:
+                    # A resent copy: accept it, but keep the one already stored
+                    delivered.append(recipient)
+                    continue
+                seen.add((mailbox_id, message.message_id))
+            emails.append(Email(
+                message_id=message.message_id,
+                mailbox_id=mailbox_id,
+                sender=message.sender[:254],
+                recipient=recipient,
+                subject=message.subject[:998],
+                snippet=message.snippet,
+                body_text=message.body_text,
+                body_html=message.body_html,
+                body_text_blob=message.body_text_blob,
+                body_html_blob=message.body_html_blob,
+                display_text=message.display_text,
+                display_html=message.display_html,
+                display_text_blob=message.display_text_blob,
+                display_html_blob=message.display_html_blob,
+                render_version=message.render_version,
+                raw_blob=message.raw_blob,
+                size_bytes=message.size_bytes,
+            ))
+            sources.append(message)
+            tokens.append(token)
+            delivered.append(recipient)
+        stored.append(delivered)
+
+    if emails:
+        with transaction.atomic():
+            Email.objects.bulk_create(emails)
+            Attachment.objects.bulk_create(_attachments(emails, sources))
+        changes = {}
+        for token, email in zip(tokens, emails):
+            count, latest = changes.get(token, (0, email.received_at))
+            changes[token] = (count + 1, max(latest, email.received_at))
+        mailbox_versions.record_changes(changes)
+        events.publish_new_emails(list(zip(tokens, emails)))
+    return stored
+
+
+class EmailWriter:
+    """Queue that stores incoming messages in micro-batches.
+
+    A batch is flushed once it holds ``batch_size`` recipients or its first
+    message has waited ``max_delay`` seconds. ``submit`` only returns after
+    the batch is committed, so a 250 reply always means the mail is durable.
+    """
+
+    def __init__(self, batch_size=None, max_delay=None):
+        self.batch_size = settings.SMTP_WRITE_BATCH_SIZE if batch_size is None else batch_size
+        self.max_delay = settings.SMTP_WRITE_BATCH_DELAY_MS / 1000 if max_delay is None else max_delay
+        self.queue = asyncio.Queue()
+        # Submit times of messages not stored yet, oldest first; batches
+        # are taken and stored in submission order
+        self.pending = collections.deque()
+
+    def backlog(self):
+        """Return ``(messages waiting, seconds the oldest has waited)``."""
+        if not self.pending:
+            return 0, 0.0
+        return len(self.pending), time.monotonic() - self.pending[0]
+
+    async def drain(self):
+        """Wait until every message submitted so far has been handled."""
+        while self.pending:
+            await asyncio.sleep(0.05)
+
+    async def submit(self, message):
+        """Queue ``message`` and wait for it to be stored. Returns the delivered recipients."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(time.monotonic())
+        await self.queue.put((message, future))
+        return await future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        size = len(batch[0][0].recipients)
+        deadline = loop.time() + self.max_delay
+        while size < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except TimeoutError:
+                break
+            batch.append(item)
+            size += len(item[0].recipients)
+        return batch
+
+    async def _write(self, batch):
+        try:
+            stored = await sync_to_async(write_batch)([message for message, _ in batch])
+        except Exception as exc:
+            if len(batch) > 1 and isinstance(exc, (DataError, IntegrityError)):
+                # A row the database rejects fails its whole batch; store the
+                # messages one at a time so only that one is deferred
+                logger.warning("Failed to store batch of %d message(s), retrying one at a time", len(batch))
+                for item in batch:
+                    await self._write([item])
+                return
+            logger.exception("Failed to store batch of %d message(s)", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future), delivered in zip(batch, stored):
+            if not future.done():
+                future.set_result(delivered)
+
+    async def run(self):
+        """Flush batches until cancelled."""
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self.pending.popleft()
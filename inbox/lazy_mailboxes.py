@@ -0,0 +1,138 @@
+"""Signed mailboxes that only get a database row when they are first used.
+
+With ``LAZY_MAILBOXES`` on, visiting the home page mints an address and token
+without writing anything. The local part carries the mailbox's expiry and a
+MAC over the full address, so the SMTP server can accept mail for it without
+a lookup; the row is created when the first email is stored. The token is a
+separate MAC (keyed differently, so an address never reveals its token) and
+becomes the row's token, so inbox links keep working once it exists.
+
+Local part: 5 random characters, the expiry in minutes since the epoch as 6
+base-36 digits, then an 8 character MAC. Token: ``<local>.<domain id>.<MAC>``;
+regular tokens never contain a dot.
+"""
+
+import math
+import secrets
+import string
+from datetime import UTC, datetime
+
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .domains import registry
+from .models import Mailbox, default_expiry
+
+ALPHABET = string.digits + string.ascii_lowercase
+RANDOM_LENGTH = 5
+EXPIRY_LENGTH = 6
+ADDRESS_MAC_LENGTH = 8
+LOCAL_LENGTH = RANDOM_LENGTH + EXPIRY_LENGTH + ADDRESS_MAC_LENGTH
+TOKEN_MAC_LENGTH = 32
+
+ADDRESS_SALT = "voidmail.lazy_mailboxes.address"
+TOKEN_SALT = "voidmail.lazy_mailboxes.token"
+
+
+def _base36(number, width):
+    digits = []
+    for _ in range(width):
+        number, digit = divmod(number, 36)
+        digits.append(ALPHABET[digit])
+    return "".join(reversed(digits))
+
+
+def _address_mac(prefix, domain_name):
+    digest = salted_hmac(ADDRESS_SALT, f"{prefix}@{domain_name}", algorithm="sha256").digest()
+    return _base36(int.from_bytes(digest[:8]), ADDRESS_MAC_LENGTH)
+
+
+def _token_mac(local, domain_id):
+    return salted_hmac(TOKEN_SALT, f"{local}@{domain_id}", algorithm="sha256").hexdigest()[:TOKEN_MAC_LENGTH]
+
+
+def _expiry(local):
+    try:
+        minutes = int(local[RANDOM_LENGTH:RANDOM_LENGTH + EXPIRY_LENGTH], 36)
+    except ValueError:
+        return None
+    return datetime.fromtimestamp(minutes * 60, tz=UTC)
+
+
+def generate(domain):
+    """Return an unsaved ``Mailbox`` with a signed address and token on ``domain``."""
+    expires_at = default_expiry()
+    domain_name = domain.name.lower()
+    prefix = "".join(secrets.choice(ALPHABET) for _ in range(RANDOM_LENGTH))
+    prefix += _base36(math.ceil(expires_at.timestamp() / 60), EXPIRY_LENGTH)
+    local = prefix + _address_mac(prefix, domain_name)
+    return Mailbox(
+        domain=domain,
+        address=f"{local}@{domain_name}",
+        token=f"{local}.{domain.id}.{_token_mac(local, domain.id)}",
+        expires_at=_expiry(local),
+    )
+
+
+def parse_address(address):
+    """Return the expiry encoded in a signed address, or None if ``address`` isn't one."""
+    local, _, domain_name = address.lower().rpartition("@")
+    if len(local) != LOCAL_LENGTH:
+        return None
+    prefix, mac = local[:-ADDRESS_MAC_LENGTH], local[-ADDRESS_MAC_LENGTH:]
+    if not constant_time_compare(mac, _address_mac(prefix, domain_name)):
+        return None
+    return _expiry(local)
+
+
+def is_live(address):
+    expires_at = parse_address(address)
+    return expires_at is not None and expires_at > timezone.now()
+
+
+def parse_token(token):
+    """Return ``(local part, domain id, expiry)`` for a signed token, or None."""
+    local, domain_id, mac = (token.split(".") + ["", ""])[:3]
+    if len(local) != LOCAL_LENGTH or not domain_id.isdigit():
+        return None
+    if not constant_time_compare(mac, _token_mac(local, int(domain_id))):
+        return None
+    return local, int(domain_id), _expiry(local)
+
+
+def from_token(token):
+    """Return an unsaved ``Mailbox`` for a signed token, or None.
+
+    Looks the domain up in ``registry`` as is; callers refresh it.
+    """
+    parsed = parse_token(token)
+    if parsed is None:
+        return None
+    local, domain_id, expires_at = parsed
+    domain = registry.get(domain_id)
+    if domain is None:
+        return None
+    return Mailbox(domain=domain, address=f"{local}@{domain.name.lower()}", token=token, expires_at=expires_at)
+
+
+def materialize(addresses):
+    """Create rows for live signed addresses that have none. Returns ``{address: Mailbox}``."""
+    live = {address.lower() for address in addresses if is_live(address)}
+    if not live:
+        return {}
+    registry.refresh_if_due()
+    mailboxes = {}
+    for address in live:
+        local, _, domain_name = address.rpartition("@")
+        domain = registry.get_by_name(domain_name)
+        if domain is None:
+            continue
+        mailboxes[address], _ = Mailbox.objects.get_or_create(
+            address=address,
+            defaults={
+                "domain": domain,
+                "token": f"{local}.{domain.id}.{_token_mac(local, domain.id)}",
+                "expires_at": _expiry(local),
+            },
+        )
+    return mailboxes
@@ -0,0 +1,112 @@
+"""Redis index of live mailbox addresses, used to reject unknown recipients at RCPT.
+
+Addresses live in a sorted set scored by their expiry timestamp, so expired
+mailboxes drop out of lookups on their own and ``prune`` only bounds its size.
+The index is authoritative only while ``READY_KEY`` is set. An add that
+fails drops that key, so lookups fall back to the database until cleanup's
+``ensure_built`` has rebuilt the index with the missing address.
+"""
+
+import logging
+import time
+
+import redis
+from django.utils import timezone
+
+from .models import Mailbox
+from .redis_client import get_async_redis, get_redis
+
+logger = logging.getLogger("voidmail.mailbox_index")
+
+INDEX_KEY = "voidmail:mailboxes:live"
+READY_KEY = "voidmail:mailboxes:ready"
+
+REBUILD_CHUNK_SIZE = 5000
+
+
+def add(address, expires_at):
+    client = get_redis()
+    try:
+        client.zadd(INDEX_KEY, {address.lower(): expires_at.timestamp()})
+    except redis.RedisError:
+        logger.warning("Could not add %s to mailbox index, marking it incomplete", address, exc_info=True)
+        try:
+            client.delete(READY_KEY)
+        except redis.RedisError:
+            logger.error("Could not mark mailbox index incomplete", exc_info=True)
+
+
+def remove(*addresses):
+    if not addresses:
+        return
+    try:
+        get_redis().zrem(INDEX_KEY, *(address.lower() for address in addresses))
+    except redis.RedisError:
+        logger.warning("Could not remove %d address(es) from mailbox index", len(addresses), exc_info=True)
+
+
+def prune():
+    """Drop expired addresses. Returns the number removed."""
+    try:
+        return get_redis().zremrangebyscore(INDEX_KEY, "-inf", time.time())
+    except redis.RedisError:
+        logger.warning("Could not prune mailbox index", exc_info=True)
+        return 0
+
+
+def _load(client, key, queryset):
+    pipe = client.pipeline(transaction=False)
+    loaded = 0
+    for address, expires_at in queryset.values_list("address", "expires_at").iterator(chunk_size=REBUILD_CHUNK_SIZE):
+        pipe.zadd(key, {address.lower(): expires_at.timestamp()})
+        loaded += 1
+        if loaded % REBUILD_CHUNK_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+    return loaded
+
+
+def rebuild():
+    """Rebuild the index from the database. Returns the number of live mailboxes."""
+    client = get_redis()
+    started = timezone.now()
+    staging_key = f"{INDEX_KEY}:rebuild"
+    client.delete(staging_key)
+    loaded = _load(client, staging_key, Mailbox.objects.filter(expires_at__gt=started))
+    if loaded:
+        client.rename(staging_key, INDEX_KEY)
+    else:
+        client.delete(INDEX_KEY)
+    # Mailboxes created during the rebuild were added to the old key; re-add them
+    _load(client, INDEX_KEY, Mailbox.objects.filter(created_at__gte=started))
+    client.set(READY_KEY, 1)
+    return loaded
+
+
+def ensure_built():
+    """Rebuild the index if it has never been built (or Redis was flushed).
+
+    Returns the number of mailboxes loaded, or None if no rebuild happened.
+    """
+    try:
+        if get_redis().exists(READY_KEY):
+            return None
+        return rebuild()
+    except redis.RedisError:
+        logger.warning("Could not build mailbox index", exc_info=True)
+        return None
+
+
+async def is_live(address):
+    """Return whether ``address`` has a live mailbox, or None if the index can't tell."""
+    try:
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.exists(READY_KEY)
+            pipe.zscore(INDEX_KEY, address.lower())
+            ready, expires = await pipe.execute()
+    except redis.RedisError:
+        logger.warning("Mailbox index unavailable, falling back to database", exc_info=True)
+        return None
+    if not ready:
+        return None
+    return expires is not None and expires > time.time()
@@ -0,0 +1,111 @@
+"""Per-mailbox change state in Redis, so polling can be answered without the database.
+
+Each live mailbox has a hash holding a ``version`` (bumped on every change),
+the number of visible emails, the newest ``received_at`` and the expiry. The
+hash is only created together with the mailbox and expires with it, so a
+missing hash means "unknown" and callers fall back to the database; existing
+hashes are only ever updated, never recreated with a guessed count.
+"""
+
+import logging
+import math
+import secrets
+
+import redis
+
+from .redis_client import get_async_redis, get_redis
+
+logger = logging.getLogger("voidmail.mailbox_versions")
+
+KEY_PREFIX = "voidmail:mailbox-state:"
+
+# KEYS[1] = state key; ARGV = created flag, initial version, expiry timestamp, EXPIREAT seconds
+_SAVE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    if ARGV[1] ~= '1' then
+        return 0
+    end
+    redis.call('HSET', KEYS[1], 'version', ARGV[2], 'count', 0, 'latest', 0)
+end
+redis.call('HSET', KEYS[1], 'expires', ARGV[3])
+redis.call('EXPIREAT', KEYS[1], ARGV[4])
+return 1
+"""
+
+# KEYS[1] = state key; ARGV = change in count, newest received_at timestamp (or empty)
+_CHANGE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('HINCRBY', KEYS[1], 'count', ARGV[1])
+if ARGV[2] ~= '' and tonumber(ARGV[2]) > tonumber(redis.call('HGET', KEYS[1], 'latest')) then
+    redis.call('HSET', KEYS[1], 'latest', ARGV[2])
+end
+return 1
+"""
+
+
+def state_key(token):
+    return f"{KEY_PREFIX}{token}"
+
+
+def saved(token, expires_at, created):
+    """Create the state for a new mailbox, or move the expiry of an existing one."""
+    expires = expires_at.timestamp()
+    try:
+        get_redis().register_script(_SAVE_SCRIPT)(
+            keys=[state_key(token)],
+            # A random starting version keeps ETags from a previous hash for
+            # this token (e.g. before a Redis flush) from matching again
+            args=[int(created), secrets.randbits(48), expires, math.ceil(expires)],
+        )
+    except redis.RedisError:
+        logger.warning("Could not save state for mailbox %s", token, exc_info=True)
+
+
+def deleted(*tokens):
+    if not tokens:
+        return
+    try:
+        get_redis().delete(*(state_key(token) for token in tokens))
+    except redis.RedisError:
+        logger.warning("Could not delete state for %d mailbox(es)", len(tokens), exc_info=True)
+
+
+def record_changes(changes):
+    """Apply ``{token: (count delta, newest received_at or None)}`` in one round trip."""
+    if not changes:
+        return
+    try:
+        client = get_redis()
+        script = client.register_script(_CHANGE_SCRIPT)
+        pipe = client.pipeline(transaction=False)
+        for token, (delta, latest) in changes.items():
+            script(
+                keys=[state_key(token)],
+                args=[delta, "" if latest is None else latest.timestamp()],
+                client=pipe,
+            )
+        pipe.execute()
+    except redis.RedisError:
+        # The hashes would now be behind; drop them so readers use the database
+        logger.warning("Could not record changes for %d mailbox(es)", len(changes), exc_info=True)
+        deleted(*changes)
+
+
+async def aget_state(token):
+    """Return the mailbox state as a dict, or None if Redis doesn't know it."""
+    try:
+        state = await get_async_redis().hgetall(state_key(token))
+    except redis.RedisError:
+        logger.warning("Could not read state for mailbox %s", token, exc_info=True)
+        return None
+    if not state:
+        return None
+    return {
+        "version": int(state[b"version"]),
+        "count": int(state[b"count"]),
+        "latest": float(state[b"latest"]),
+        "expires": float(state[b"expires"]),
+    }
@@ -0,0 +1,73 @@
+"""Management command to benchmark VoidMail hot paths."""
+
+import json
+import platform
+import subprocess
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inbox.benchmarks import SCENARIOS, compare
+
+
+def _revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Benchmark VoidMail hot paths"
+
+    def add_arguments(self, parser):
+        scenarios = parser.add_subparsers(dest="scenario", required=True)
+        self.scenario_options = {}
+        for name, module in SCENARIOS.items():
+            subparser = scenarios.add_parser(name, help=module.__doc__.strip().splitlines()[0])
+            module.add_arguments(subparser)
+            self.scenario_options[name] = [action.dest for action in subparser._actions if action.dest != "help"]
+            subparser.add_argument(
+                "--output", default=None,
+                help="Save the results as JSON to this file",
+            )
+            subparser.add_argument(
+                "--compare", default=None,
+                help="Report changes against results saved with --output",
+            )
+
+    def handle(self, *args, **options):
+        scenario = options["scenario"]
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+            if baseline["scenario"] != scenario:
+                raise CommandError(f"{options['compare']} has results of {baseline['scenario']!r}, not {scenario!r}")
+
+        self.stdout.write(f"Running benchmark: {scenario}")
+        started_at = timezone.now()
+        results = SCENARIOS[scenario].run(self, options)
+
+        if baseline is not None:
+            self.stdout.write(f"Changes since {baseline['revision'] or options['compare']}:")
+            for line in compare(baseline["results"], results):
+                self.stdout.write(f"  {line}")
+        if options["output"]:
+            report = {
+                "scenario": scenario,
+                "revision": _revision(),
+                "started_at": started_at.isoformat(),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "options": {name: options[name] for name in self.scenario_options[scenario]},
+                "results": results,
+            }
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2, default=str)
+            self.stdout.write(f"Results saved to {options['output']}")
@@ -1,12 +1,15 @@
 """Continuous cleanup of expired mailboxes."""
 
 import time
+from itertools import chain
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db.models import Exists, Min, OuterRef
 from django.utils import timezone
 
-from inbox.models import Mailbox
+from inbox import blobs, deletion, mailbox_index, metrics, partitions
+from inbox.models import Attachment, Email, Mailbox
 
 
 class Command(BaseCommand):
@@ -21,17 +24,84 @@ class Command(BaseCommand):
             "--once", action="store_true",
             help="Run cleanup once and exit",
         )
+        parser.add_argument(
+            "--gc-interval", type=int, default=3600,
+            help="Seconds between sweeps for unreferenced blobs, 0 to disable (default: 3600)",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=deletion.DEFAULT_BATCH_SIZE,
+            help=f"Mailboxes deleted per transaction (default: {deletion.DEFAULT_BATCH_SIZE})",
+        )
+        parser.add_argument(
+            "--throttle", type=int, default=0,
+            help="Milliseconds to pause between delete batches (default: 0)",
+        )
+        parser.add_argument(
+            "--metrics-port", type=int, default=None,
+            help="Serve Prometheus metrics over HTTP on this port",
+        )
+
+    def referenced_blobs(self):
+        rows = Email.objects.values_list(
+            "raw_blob", "body_text_blob", "body_html_blob", "display_text_blob", "display_html_blob",
+        )
+        attachments = Attachment.objects.values_list("blob")
+        return {
+            key
+            for key in chain.from_iterable(chain(rows.iterator(chunk_size=5000), attachments.iterator(chunk_size=5000)))
+            if key
+        }
 
     def handle(self, *args, **options):
         interval = options["interval"]
         once = options["once"]
+        gc_interval = options["gc_interval"]
+        last_gc = None
 
         self.stdout.write(f"Cleanup service started (interval: {interval}s)")
+        if options["metrics_port"]:
+            metrics.start_server(options["metrics_port"])
+            self.stdout.write(f"Serving metrics on port {options['metrics_port']}")
+
+        def progress(stats):
+            if options["verbosity"] >= 2:
+                self.stdout.write(f"  ... {stats}")
 
         while True:
-            count, _ = Mailbox.objects.filter(expires_at__lte=timezone.now()).delete()
-            if count:
-                self.stdout.write(f"Deleted {count} expired object(s)")
+            started = time.perf_counter()
+            expired = Mailbox.objects.filter(expires_at__lte=timezone.now())
+            if partitions.is_partitioned():
+                # Emails go with their partitions; a mailbox is deleted once it has none left
+                for name in partitions.drop_expired():
+                    self.stdout.write(f"Dropped partition {name}")
+                for name in partitions.ensure_upcoming():
+                    self.stdout.write(f"Created partition {name}")
+                stray = partitions.purge_default()
+                if stray:
+                    self.stdout.write(f"Deleted {stray} email(s) from the default partition")
+                expired = expired.filter(~Exists(Email.objects.filter(mailbox=OuterRef("pk"))))
+
+            stats = deletion.delete_mailboxes(
+                expired,
+                batch_size=options["batch_size"],
+                throttle=options["throttle"] / 1000,
+                progress=progress,
+            )
+            if stats.mailboxes:
+                self.stdout.write(f"Deleted {stats}")
+            now = timezone.now()
+            oldest = Mailbox.objects.filter(expires_at__lte=now).aggregate(oldest=Min("expires_at"))["oldest"]
+            metrics.CLEANUP_LAG_SECONDS.set((now - oldest).total_seconds() if oldest else 0)
+
+            mailbox_index.ensure_built()
+            mailbox_index.prune()
+
+            if gc_interval and (last_gc is None or time.monotonic() - last_gc >= gc_interval):
+                removed = blobs.collect_garbage(self.referenced_blobs())
+                last_gc = time.monotonic()
+                if removed:
+                    self.stdout.write(f"Deleted {removed} unreferenced blob(s)")
+            metrics.CLEANUP_SWEEP_SECONDS.observe(time.perf_counter() - started)
 
             if once:
                 break
@@ -0,0 +1,37 @@
+"""Convert inbox_email to time partitions and maintain them."""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from inbox import partitions
+
+
+class Command(BaseCommand):
+    help = "Pre-create upcoming inbox_email partitions and drop expired ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert", action="store_true",
+            help="Rebuild inbox_email as a partitioned table first (locks the table while copying)",
+        )
+        parser.add_argument(
+            "--ahead", type=int, default=None,
+            help="Future partitions to keep ready (default: EMAIL_PARTITIONS_AHEAD)",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Email partitioning requires PostgreSQL")
+
+        if options["convert"]:
+            if partitions.is_partitioned():
+                raise CommandError(f"{partitions.PARENT_TABLE} is already partitioned")
+            copied = partitions.convert(ahead=options["ahead"])
+            self.stdout.write(self.style.SUCCESS(f"Partitioned {partitions.PARENT_TABLE} ({copied} row(s) copied)"))
+        elif not partitions.is_partitioned():
+            raise CommandError(f"{partitions.PARENT_TABLE} is not partitioned; run with --convert first")
+
+        for name in partitions.ensure_upcoming(ahead=options["ahead"]):
+            self.stdout.write(f"Created partition {name}")
+        for name in partitions.drop_expired():
+            self.stdout.write(f"Dropped partition {name}")
@@ -3,10 +3,11 @@
 from datetime import timedelta
 
 from django.core.management.base import BaseCommand
-from django.db.models import Count, Q
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
 
-from inbox.models import Mailbox
+from inbox import deletion
+from inbox.models import Email, Mailbox
 
 
 class Command(BaseCommand):
@@ -21,6 +22,14 @@ class Command(BaseCommand):
             "--dry-run", action="store_true",
             help="Show what would be deleted without actually deleting",
         )
+        parser.add_argument(
+            "--batch-size", type=int, default=deletion.DEFAULT_BATCH_SIZE,
+            help=f"Mailboxes deleted per transaction (default: {deletion.DEFAULT_BATCH_SIZE})",
+        )
+        parser.add_argument(
+            "--max-runtime", type=int, default=None,
+            help="Stop deleting after this many seconds; the rest is left for the next run",
+        )
 
     def handle(self, *args, **options):
         hours = options["hours"]
@@ -28,26 +37,32 @@ class Command(BaseCommand):
         
         cutoff_time = timezone.now() - timedelta(hours=hours)
         
-        # Find mailboxes older than cutoff with no non-deleted emails
-        empty_mailboxes = Mailbox.objects.annotate(
-            active_email_count=Count("emails", filter=Q(emails__is_deleted=False))
-        ).filter(
-            created_at__lte=cutoff_time,
-            active_email_count=0
+        # Mailboxes older than cutoff with no non-deleted emails, as an anti-join
+        empty_mailboxes = Mailbox.objects.filter(created_at__lte=cutoff_time).filter(
+            ~Exists(Email.objects.filter(mailbox=OuterRef("pk"), is_deleted=False))
         )
         
-        count = empty_mailboxes.count()
-        
-        if count == 0:
-            self.stdout.write("No empty mailboxes to purge.")
-            return
-        
         if dry_run:
-            self.stdout.write(f"Would delete {count} empty mailbox(es):")
-            for mb in empty_mailboxes:
-                self.stdout.write(f"  - {mb.address} (created {mb.created_at})")
+            # Streamed through a server-side cursor instead of loaded at once
+            count = 0
+            rows = empty_mailboxes.values_list("address", "created_at").iterator(chunk_size=2000)
+            for address, created_at in rows:
+                if not count:
+                    self.stdout.write("Would delete these empty mailbox(es):")
+                self.stdout.write(f"  - {address} (created {created_at})")
+                count += 1
+            if count:
+                self.stdout.write(f"Would delete {count} empty mailbox(es).")
+            else:
+                self.stdout.write("No empty mailboxes to purge.")
             return
         
-        # Delete the empty mailboxes
-        deleted, _ = empty_mailboxes.delete()
-        self.stdout.write(f"Deleted {deleted} empty mailbox(es) older than {hours} hour(s).")
+        stats = deletion.delete_mailboxes(
+            empty_mailboxes, batch_size=options["batch_size"], max_runtime=options["max_runtime"],
+        )
+        if not stats.mailboxes:
+            self.stdout.write("No empty mailboxes to purge.")
+            return
+        self.stdout.write(f"Deleted {stats.mailboxes} empty mailbox(es) older than {hours} hour(s).")
+        if stats.timed_out:
+            self.stdout.write(f"Stopped after {stats.elapsed:.0f}s; the remaining mailboxes will be purged on the next run.")
@@ -0,0 +1,58 @@
+"""Re-render the display versions of stored emails after the rendering pipeline changed."""
+
+from django.core.management.base import BaseCommand
+
+from inbox import blobs, page_cache, rendering
+from inbox.ingest import offload_bodies
+from inbox.models import Email
+from inbox.parsing import parse_message
+
+DISPLAY_FIELDS = ["display_text", "display_html", "display_text_blob", "display_html_blob", "render_version"]
+
+
+class Command(BaseCommand):
+    help = f"Re-render emails rendered by a pipeline older than version {rendering.RENDER_VERSION}"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all", action="store_true",
+            help="Re-render every email, including those already at the current version",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=200,
+            help="Emails loaded and updated at a time (default: 200)",
+        )
+
+    def render(self, email):
+        # The raw message has the inline images; without it, use the stored bodies
+        if email.raw_blob:
+            parsed = parse_message(blobs.read(email.raw_blob))
+            return parsed.display_text, parsed.display_html
+        rendered = rendering.render(email.get_body_text(), email.get_body_html())
+        return rendered.text, rendered.html
+
+    def handle(self, *args, **options):
+        emails = Email.objects.filter(is_deleted=False).order_by("pk")
+        if not options["all"]:
+            emails = emails.filter(render_version__lt=rendering.RENDER_VERSION)
+
+        total = 0
+        last_pk = 0
+        while True:
+            batch = list(emails.filter(pk__gt=last_pk)[:options["batch_size"]])
+            if not batch:
+                break
+            for email in batch:
+                display_text, display_html = self.render(email)
+                for name, value in offload_bodies(display_text=display_text, display_html=display_html).items():
+                    setattr(email, name, value)
+                email.render_version = rendering.RENDER_VERSION
+            Email.objects.bulk_update(batch, DISPLAY_FIELDS)
+            for email in batch:
+                page_cache.invalidate_email(email.pk)
+            total += len(batch)
+            last_pk = batch[-1].pk
+            if options["verbosity"] >= 2:
+                self.stdout.write(f"  {total} email(s) re-rendered")
+
+        self.stdout.write(f"Re-rendered {total} email(s) to version {rendering.RENDER_VERSION}.")
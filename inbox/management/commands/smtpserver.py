@@ -1,81 +1,226 @@
 """SMTP server that receives emails and stores them in the database."""
 
 import asyncio
-import email
-import email.policy
+import contextlib
+import functools
 import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-from aiosmtpd.controller import Controller
 from aiosmtpd.smtp import SMTP as SMTPServer
+from asgiref.sync import sync_to_async
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 from django.utils import timezone
 
-from inbox.models import Domain, Email, Mailbox
+from inbox import lazy_mailboxes, mailbox_index, metrics
+from inbox.admission import Admission
+from inbox.domains import registry
+from inbox.ingest import EmailWriter, IncomingMessage, offload
+from inbox.models import Mailbox
+from inbox.parsing import parse_message
+from inbox.rendering import RENDER_VERSION
 
 logger = logging.getLogger("voidmail.smtp")
 
+# Seconds to wait before restarting a crashed worker, and for workers to
+# finish their sessions on shutdown before they are killed
+WORKER_RESTART_DELAY = 1
+WORKER_SHUTDOWN_TIMEOUT = 30
+# Within that: seconds for open sessions to finish, then for the writer to
+# store the messages already accepted
+SESSION_DRAIN_TIMEOUT = 20
+WRITER_DRAIN_TIMEOUT = 5
+
+
+TEMPORARY_PARSE_FAILURE = "451 4.3.0 Temporary failure processing message, try again later"
+UNPARSEABLE = "554 5.6.0 Message could not be parsed"
+
+
+def parse_executor(workers):
+    """Process pool for MIME parsing, spawned so workers don't inherit the server's state."""
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def client_address(session):
+    peer = session.peer
+    return peer[0] if isinstance(peer, tuple) else str(peer)
+
+
+class VoidMailSMTP(SMTPServer):
+    """aiosmtpd's SMTP protocol, asking the handler's admission control before the greeting."""
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.event_handler.connections.add(self)
+
+    def connection_lost(self, error):
+        self.event_handler.connections.discard(self)
+        super().connection_lost(error)
+
+    async def _handle_client(self):
+        # aiosmtpd has no hook between accepting a connection and sending 220
+        admission = self.event_handler.admission
+        if admission is None:
+            return await super()._handle_client()
+        reply = await admission.admit_session(client_address(self.session))
+        if reply is not None:
+            await self.push(reply)
+            self.transport.close()
+            return
+        metrics.SMTP_SESSIONS.inc()
+        try:
+            await super()._handle_client()
+        finally:
+            admission.end_session()
+            metrics.SMTP_SESSIONS.dec()
+
 
 class VoidMailHandler:
+    def __init__(self, domains=None, writer=None, executor=None, admission=None, new_executor=None):
+        self.domains = domains if domains is not None else registry
+        self.writer = writer if writer is not None else EmailWriter()
+        # Process pool for MIME parsing; None parses on the event loop
+        self.executor = executor
+        # Makes a replacement once a worker has died and broken the pool;
+        # without it, parsing falls back to the event loop
+        self.new_executor = new_executor
+        # Session and message limits; None admits everything
+        self.admission = admission
+        # Open connections, given time to finish on shutdown
+        self.connections = set()
+        # Raw message bytes currently held for parsing, across all sessions
+        self.inflight_bytes = 0
+        self.peak_inflight_bytes = 0
+
+    def replace_executor(self, broken):
+        # Every message in flight on the broken pool fails at once; replace it only once
+        if self.executor is not broken:
+            return
+        self.executor = self.new_executor() if self.new_executor is not None else None
+        broken.shutdown(wait=False)
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        if self.admission is not None:
+            reply = await self.admission.admit_message(client_address(session))
+            if reply is not None:
+                return reply
+        envelope.mail_from = address
+        envelope.mail_options.extend(mail_options)
+        return "250 OK"
+
     async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        start = time.perf_counter()
+        reply = await self._check_recipient(envelope, address)
+        metrics.SMTP_RCPT_SECONDS.observe(time.perf_counter() - start)
+        if not reply.startswith("250"):
+            metrics.RECIPIENTS_REJECTED.inc()
+        return reply
+
+    async def _check_recipient(self, envelope, address):
         domain = address.split("@")[-1].lower()
-        # Check if domain is active in our database
-        domain_exists = await Domain.objects.filter(name__iexact=domain, is_active=True).aexists()
-        if not domain_exists:
+        # Check against the in-process set of active domains
+        if domain not in self.domains:
             return f"550 not relaying to {domain}"
+        # Reject unknown/expired mailboxes before the client sends DATA.
+        # Signed lazy addresses are checked by their MAC and created on delivery.
+        if settings.LAZY_MAILBOXES and lazy_mailboxes.is_live(address):
+            envelope.rcpt_tos.append(address)
+            return "250 OK"
+        live = await mailbox_index.is_live(address)
+        if live is None:
+            live = await Mailbox.objects.filter(
+                address=address.lower(),
+                expires_at__gt=timezone.now(),
+            ).aexists()
+        if not live:
+            return f"550 5.1.1 <{address}>: mailbox unavailable"
         envelope.rcpt_tos.append(address)
         return "250 OK"
 
     async def handle_DATA(self, server, session, envelope):
-        raw = envelope.content
-        if isinstance(raw, bytes):
-            raw_str = raw.decode("utf-8", errors="replace")
-        else:
-            raw_str = raw
-
-        msg = email.message_from_string(raw_str, policy=email.policy.default)
-        sender = envelope.mail_from or msg.get("From", "unknown@unknown")
-        subject = msg.get("Subject", "(no subject)") or "(no subject)"
-
-        body_text = ""
-        body_html = ""
-
-        if msg.is_multipart():
-            for part in msg.walk():
-                ct = part.get_content_type()
-                if ct == "text/plain" and not body_text:
-                    body_text = part.get_content()
-                elif ct == "text/html" and not body_html:
-                    body_html = part.get_content()
-        else:
-            ct = msg.get_content_type()
-            content = msg.get_content()
-            if ct == "text/html":
-                body_html = content
-            else:
-                body_text = content
+        start = time.perf_counter()
+        reply = await self._store(envelope)
+        metrics.SMTP_DATA_SECONDS.observe(time.perf_counter() - start)
+        (metrics.MESSAGES_ACCEPTED if reply.startswith("250") else metrics.MESSAGES_FAILED).inc()
+        return reply
 
-        size_bytes = len(raw) if isinstance(raw, bytes) else len(raw.encode("utf-8"))
-
-        for recipient in envelope.rcpt_tos:
+    async def _store(self, envelope):
+        # aiosmtpd stops buffering past data_size_limit and answers 552 itself,
+        # so raw is at most MAX_MESSAGE_SIZE bytes
+        raw = envelope.original_content or envelope.content
+        size_bytes = len(raw)
+        metrics.SMTP_RECEIVED_BYTES.inc(size_bytes)
+        self.inflight_bytes += size_bytes
+        self.peak_inflight_bytes = max(self.peak_inflight_bytes, self.inflight_bytes)
+        try:
+            start = time.perf_counter()
+            executor = self.executor
             try:
-                mailbox = await Mailbox.objects.aget(
-                    address__iexact=recipient,
-                    expires_at__gt=timezone.now(),
-                )
-                await Email.objects.acreate(
-                    mailbox=mailbox,
-                    sender=sender,
-                    recipient=recipient,
-                    subject=subject[:998],
-                    body_text=body_text,
-                    body_html=body_html,
-                    size_bytes=size_bytes,
+                if executor is None:
+                    parsed = parse_message(raw)
+                else:
+                    parsed = await asyncio.get_running_loop().run_in_executor(executor, parse_message, raw)
+            except BrokenProcessPool:
+                logger.error("A parse worker died, replacing the parse pool")
+                self.replace_executor(executor)
+                return TEMPORARY_PARSE_FAILURE
+            except Exception:
+                logger.exception("Failed to parse message")
+                return UNPARSEABLE
+            metrics.SMTP_PARSE_SECONDS.observe(time.perf_counter() - start)
+            try:
+                fields = await sync_to_async(offload, thread_sensitive=False)(
+                    raw,
+                    # Bodies of a message to several mailboxes are stored once, as shared blobs
+                    copies=len(envelope.rcpt_tos),
+                    body_text=parsed.body_text,
+                    body_html=parsed.body_html,
+                    display_text=parsed.display_text,
+                    display_html=parsed.display_html,
+                    attachments=parsed.attachments,
                 )
-                logger.info("Stored email from %s to %s: %s", sender, recipient, subject)
-            except Mailbox.DoesNotExist:
-                logger.debug("Discarded email for unknown/expired address: %s", recipient)
+            except Exception:
+                logger.exception("Failed to write message blobs")
+                return "451 4.3.0 Temporary failure storing message, try again later"
+        finally:
+            self.inflight_bytes -= size_bytes
+        # Only the extracted fields are needed from here on
+        del raw
+        envelope.content = envelope.original_content = None
+
+        sender = envelope.mail_from or parsed.from_header or "unknown@unknown"
+        subject = parsed.subject
+
+        message = IncomingMessage(
+            sender=sender,
+            subject=subject,
+            snippet=parsed.snippet,
+            size_bytes=size_bytes,
+            recipients=list(envelope.rcpt_tos),
+            message_id=parsed.message_id,
+            render_version=RENDER_VERSION,
+            **fields,
+        )
+        try:
+            delivered = await self.writer.submit(message)
+        except Exception:
+            return "451 4.3.0 Temporary failure storing message, try again later"
+
+        discarded = set(envelope.rcpt_tos).difference(delivered)
+        metrics.RECIPIENTS_STORED.inc(len(delivered))
+        metrics.RECIPIENTS_DISCARDED.inc(len(discarded))
+        for recipient in delivered:
+            logger.info("Stored email from %s to %s: %s", sender, recipient, subject)
+        for recipient in discarded:
+            logger.debug("Discarded email for unknown/expired address: %s", recipient)
 
         return "250 Message accepted"
 
@@ -92,30 +237,182 @@ class Command(BaseCommand):
             "--host", type=str, default="0.0.0.0",
             help="Host to bind to (default: 0.0.0.0)",
         )
+        parser.add_argument(
+            "--workers", type=int, default=1,
+            help="SMTP worker processes sharing the listening port (default: 1)",
+        )
+        parser.add_argument(
+            "--parse-workers", type=int, default=None,
+            help="Processes used for MIME parsing, 0 to parse on the event loop "
+                 "(default: SMTP_PARSE_WORKERS from settings)",
+        )
+        parser.add_argument(
+            "--metrics-port", type=int, default=None,
+            help="Serve Prometheus metrics over HTTP on this port",
+        )
 
     def handle(self, *args, **options):
         port = options["port"] or settings.SMTP_PORT
         host = options["host"]
+        workers = options["workers"]
+        parse_workers = options["parse_workers"]
+        if parse_workers is None:
+            parse_workers = settings.SMTP_PARSE_WORKERS
 
         self.stdout.write(f"Starting SMTP server on {host}:{port}")
         self.stdout.write(f"Accepting mail for configured domains")
 
-        handler = VoidMailHandler()
+        domains = registry
+        domains.refresh(force=True)
+        rebuilt = mailbox_index.ensure_built()
+        if rebuilt is not None:
+            self.stdout.write(f"Built mailbox index ({rebuilt} live mailbox(es))")
+
+        if options["metrics_port"]:
+            if workers > 1 and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+                raise CommandError("--metrics-port with several --workers needs PROMETHEUS_MULTIPROC_DIR set")
+            # Started before forking; in multiprocess mode it reads every worker's files
+            metrics.start_server(options["metrics_port"])
+            self.stdout.write(f"Serving metrics on port {options['metrics_port']}")
+
+        if workers <= 1:
+            self.serve(domains, host, port, parse_workers)
+            return
+
+        # Each worker binds its own SO_REUSEPORT socket so the kernel balances
+        # connections; without it, workers share one socket bound here.
+        sock = None
+        if not hasattr(socket, "SO_REUSEPORT"):
+            sock = socket.create_server((host, port), backlog=1024)
+            sock.setblocking(False)
+        self.supervise(workers, lambda: self.serve(
+            domains, host, port, parse_workers, sock=sock, reuse_port=sock is None,
+        ))
+
+    def serve(self, domains, host, port, parse_workers, sock=None, reuse_port=False):
+        """Run one SMTP server event loop until SIGINT/SIGTERM."""
+        writer = EmailWriter()
+        executor = new_executor = None
+        if parse_workers:
+            new_executor = functools.partial(parse_executor, parse_workers)
+            executor = new_executor()
+            self.stdout.write(f"Parsing messages in {parse_workers} worker process(es)")
+        handler = VoidMailHandler(domains, writer, executor, Admission(writer), new_executor)
 
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, loop.stop)
 
-        server = Controller(
-            handler,
-            hostname=host,
-            port=port,
-        )
-        server.start()
-        self.stdout.write(self.style.SUCCESS(f"SMTP server listening on {host}:{port}"))
+        def factory():
+            # data_size_limit is advertised via ESMTP SIZE and enforced while DATA streams in
+            return VoidMailSMTP(handler, loop=loop, data_size_limit=settings.MAX_MESSAGE_SIZE)
+
+        if sock is not None:
+            server = loop.run_until_complete(loop.create_server(factory, sock=sock))
+        else:
+            server = loop.run_until_complete(
+                loop.create_server(factory, host=host, port=port, reuse_port=reuse_port)
+            )
+        tasks = [loop.create_task(domains.run()), loop.create_task(writer.run())]
+        self.stdout.write(self.style.SUCCESS(f"SMTP server listening on {host}:{port} (pid {os.getpid()})"))
 
         try:
             loop.run_forever()
-        except KeyboardInterrupt:
-            self.stdout.write("\nShutting down SMTP server...")
         finally:
-            server.stop()
+            self.stdout.write(f"Shutting down SMTP server (pid {os.getpid()})...")
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            # Stop accepting, let open sessions finish, then store what they were acknowledged
+            server.close()
+            loop.run_until_complete(self.drain(handler, writer))
+            logger.info("Peak raw message bytes held in memory: %d", handler.peak_inflight_bytes)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, server.wait_closed(), return_exceptions=True))
+            loop.close()
+            if handler.executor is not None:
+                handler.executor.shutdown(cancel_futures=True)
+
+    async def drain(self, handler, writer):
+        """Wait for open sessions, closing those still open after ``SESSION_DRAIN_TIMEOUT``, then for the writer."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SESSION_DRAIN_TIMEOUT
+        while handler.connections and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        if handler.connections:
+            logger.warning("Closing %d SMTP session(s) still open", len(handler.connections))
+            for connection in list(handler.connections):
+                if connection.transport is not None:
+                    connection.transport.close()
+        try:
+            await asyncio.wait_for(writer.drain(), WRITER_DRAIN_TIMEOUT)
+        except TimeoutError:
+            logger.warning("Gave up storing %d queued message(s)", len(writer.pending))
+
+    def supervise(self, workers, serve):
+        """Fork ``workers`` processes running ``serve`` and restart any that die."""
+        children = {}
+        stopping = False
+
+        def spawn(slot):
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                code = 0
+                try:
+                    serve()
+                except BaseException:
+                    logger.exception("SMTP worker %d crashed", slot)
+                    code = 1
+                finally:
+                    os._exit(code)
+            children[pid] = slot
+
+        def stop(signum, frame):
+            nonlocal stopping
+            if stopping:
+                return
+            stopping = True
+            self.stdout.write("\nShutting down SMTP workers...")
+            for pid in children:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGTERM)
+            signal.alarm(WORKER_SHUTDOWN_TIMEOUT)
+
+        def kill(signum, frame):
+            for pid in children:
+                with contextlib.suppress(ProcessLookupError):
+                    os.kill(pid, signal.SIGKILL)
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGALRM, kill)
+
+        # Children must open their own database connections. Closing only
+        # returns pooled connections to the pool, whose sockets and threads
+        # don't survive a fork, so close the pools too.
+        connections.close_all()
+        for connection in connections.all(initialized_only=True):
+            if hasattr(connection, "close_pool"):
+                connection.close_pool()
+        for slot in range(workers):
+            spawn(slot)
+        self.stdout.write(self.style.SUCCESS(f"Supervising {workers} SMTP worker(s)"))
+
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            slot = children.pop(pid, None)
+            if slot is None or stopping:
+                continue
+            logger.warning(
+                "SMTP worker %d (pid %d) exited with code %d, restarting",
+                slot, pid, os.waitstatus_to_exitcode(status),
+            )
+            time.sleep(WORKER_RESTART_DELAY)
+            if not stopping:
+                spawn(slot)
@@ -0,0 +1,160 @@
+"""Prometheus metrics for SMTP ingest, the web app and cleanup.
+
+The web app exposes them at ``/metrics``; ``smtpserver`` and ``cleanup``
+serve them on ``--metrics-port``. Metrics are process-local unless
+``PROMETHEUS_MULTIPROC_DIR`` points at an empty directory shared by the
+processes to aggregate (several web or SMTP workers), see
+https://prometheus.github.io/client_python/multiprocess/.
+
+Label values used on per-message paths are bound once here, so recording
+a sample is a lock and an add.
+"""
+
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.db.backends.signals import connection_created
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+# Latency buckets from 0.5ms to 10s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# SMTP ingest
+
+SMTP_RCPT_SECONDS = Histogram(
+    "voidmail_smtp_rcpt_seconds", "Time to answer RCPT TO", buckets=LATENCY_BUCKETS,
+)
+SMTP_DATA_SECONDS = Histogram(
+    "voidmail_smtp_data_seconds", "Time from end of DATA to the reply, including the database write",
+    buckets=LATENCY_BUCKETS,
+)
+SMTP_PARSE_SECONDS = Histogram(
+    "voidmail_smtp_parse_seconds", "Time to parse and render a message", buckets=LATENCY_BUCKETS,
+)
+SMTP_RECEIVED_BYTES = Counter("voidmail_smtp_received_bytes", "Raw message bytes received")
+SMTP_RECIPIENTS = Counter(
+    "voidmail_smtp_recipients", "Recipients by outcome: rejected at RCPT, stored, or discarded at delivery",
+    ["outcome"],
+)
+RECIPIENTS_REJECTED = SMTP_RECIPIENTS.labels("rejected")
+RECIPIENTS_STORED = SMTP_RECIPIENTS.labels("stored")
+RECIPIENTS_DISCARDED = SMTP_RECIPIENTS.labels("discarded")
+SMTP_MESSAGES = Counter("voidmail_smtp_messages", "Messages by DATA reply class", ["reply"])
+MESSAGES_ACCEPTED = SMTP_MESSAGES.labels("2xx")
+MESSAGES_FAILED = SMTP_MESSAGES.labels("4xx")
+SMTP_SESSIONS = Gauge("voidmail_smtp_sessions", "Open SMTP sessions", multiprocess_mode="livesum")
+SMTP_REJECTIONS = Counter(
+    "voidmail_smtp_rejections", "Sessions (421) and messages (451) refused by admission control",
+    ["stage", "reason"],
+)
+REJECTED_SESSIONS_FULL = SMTP_REJECTIONS.labels("session", "max_sessions")
+REJECTED_SESSION_OVERLOADED = SMTP_REJECTIONS.labels("session", "overloaded")
+REJECTED_CONNECTION_RATE = SMTP_REJECTIONS.labels("session", "rate_limited")
+REJECTED_MESSAGE_OVERLOADED = SMTP_REJECTIONS.labels("message", "overloaded")
+REJECTED_MESSAGE_RATE = SMTP_REJECTIONS.labels("message", "rate_limited")
+
+# Web
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "voidmail_http_request_seconds", "Request handling time by view", ["view"], buckets=LATENCY_BUCKETS,
+)
+HTTP_DB_QUERIES = Histogram(
+    "voidmail_http_db_queries", "Database queries per request by view", ["view"],
+    buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100),
+)
+HTTP_DB_SECONDS = Histogram(
+    "voidmail_http_db_seconds", "Database time per request by view", ["view"], buckets=LATENCY_BUCKETS,
+)
+POLLS = Counter(
+    "voidmail_polls",
+    "check_emails answers by source: not_modified and unchanged come from Redis alone",
+    ["result"],
+)
+POLLS_NOT_MODIFIED = POLLS.labels("not_modified")
+POLLS_UNCHANGED = POLLS.labels("unchanged")
+POLLS_DATABASE = POLLS.labels("database")
+POLLS_EXPIRED = POLLS.labels("expired")
+PAGE_CACHE = Counter("voidmail_page_cache", "Page cache lookups by kind and result", ["kind", "result"])
+
+# Database
+
+DB_QUERIES = Counter("voidmail_db_queries", "Database queries executed")
+
+# Cleanup
+
+DELETE_BATCH_MAILBOXES = Histogram(
+    "voidmail_delete_batch_mailboxes", "Mailboxes deleted per batch",
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000),
+)
+DELETED = Counter("voidmail_deleted", "Rows deleted by chunked mailbox deletion", ["kind"])
+DELETED_MAILBOXES = DELETED.labels("mailboxes")
+DELETED_EMAILS = DELETED.labels("emails")
+CLEANUP_SWEEP_SECONDS = Histogram(
+    "voidmail_cleanup_sweep_seconds", "Duration of a cleanup sweep", buckets=LATENCY_BUCKETS,
+)
+CLEANUP_LAG_SECONDS = Gauge(
+    "voidmail_cleanup_lag_seconds", "How long the oldest expired, still stored mailbox has been expired",
+    multiprocess_mode="livemax",
+)
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    seconds: float = 0.0
+
+
+# Set per request by MetricsMiddleware; copied into sync_to_async threads
+request_queries = ContextVar("request_queries", default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    DB_QUERIES.inc()
+    stats = request_queries.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.count += 1
+        stats.seconds += time.perf_counter() - start
+
+
+def _install_query_recorder(sender, connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(_install_query_recorder)
+
+
+def get_registry():
+    """The registry to export: this process's, or all processes' in multiprocess mode."""
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render():
+    """Return ``(body, content type)`` of the current metrics."""
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+
+def start_server(port, addr="0.0.0.0"):
+    """Serve the metrics over HTTP from a background thread."""
+    start_http_server(port, addr, registry=get_registry())
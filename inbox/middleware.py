@@ -0,0 +1,83 @@
+"""Middleware adapted to run without a thread hop under ASGI."""
+
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from . import metrics
+
+
+class MetricsMiddleware:
+    """Record each request's duration and database queries per view."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats, token, start = self._start()
+        try:
+            return self.get_response(request)
+        finally:
+            self._finish(request, stats, token, start)
+
+    async def __acall__(self, request):
+        stats, token, start = self._start()
+        try:
+            return await self.get_response(request)
+        finally:
+            self._finish(request, stats, token, start)
+
+    def _start(self):
+        stats = metrics.QueryStats()
+        return stats, metrics.request_queries.set(stats), time.perf_counter()
+
+    def _finish(self, request, stats, token, start):
+        elapsed = time.perf_counter() - start
+        metrics.request_queries.reset(token)
+        match = request.resolver_match
+        view = match.view_name if match is not None else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.labels(view).observe(elapsed)
+        metrics.HTTP_DB_QUERIES.labels(view).observe(stats.count)
+        metrics.HTTP_DB_SECONDS.labels(view).observe(stats.seconds)
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """WhiteNoise, usable in an async middleware chain.
+
+    WhiteNoise is sync-only, which makes Django run every request below it,
+    views included, through a thread. Serving a static file is an in-memory
+    lookup (without ``WHITENOISE_AUTOREFRESH``) plus a response whose body is
+    read later, so the lookup can just as well run on the event loop.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
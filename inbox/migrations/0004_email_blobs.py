@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0003_domain_is_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='snippet',
+            field=models.CharField(blank=True, default='', help_text='Short plain-text preview', max_length=200),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='body_text_blob',
+            field=models.CharField(blank=True, default='', help_text='Blob key when body_text is stored out of row', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='body_html_blob',
+            field=models.CharField(blank=True, default='', help_text='Blob key when body_html is stored out of row', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='raw_blob',
+            field=models.CharField(blank=True, default='', help_text='Blob key of the raw RFC 822 message', max_length=100),
+        ),
+    ]
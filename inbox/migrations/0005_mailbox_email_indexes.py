@@ -0,0 +1,60 @@
+# Generated by Django 6.0.2 on 2026-10-18 12:56
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def merge_case_duplicates(apps, schema_editor):
+    """Merge mailboxes whose addresses differ only in case, so lowercasing can't collide.
+
+    The one expiring last is kept and receives the others' emails.
+    """
+    Mailbox = apps.get_model("inbox", "Mailbox")
+    Email = apps.get_model("inbox", "Email")
+    duplicated = (
+        Mailbox.objects.annotate(lowered=Lower("address")).values("lowered")
+        .annotate(count=Count("id")).filter(count__gt=1).values_list("lowered", flat=True)
+    )
+    duplicated = list(duplicated)
+    for address in duplicated:
+        keep, *others = Mailbox.objects.filter(address__iexact=address).order_by("-expires_at", "-id")
+        Email.objects.filter(mailbox__in=others).update(mailbox=keep)
+        Mailbox.objects.filter(pk__in=[mailbox.pk for mailbox in others]).delete()
+    if duplicated and schema_editor.connection.vendor == "postgresql":
+        # Run the deferred foreign key checks now; the ALTER TABLE below
+        # refuses to run with trigger events pending
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        schema_editor.execute("SET CONSTRAINTS ALL DEFERRED")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0004_email_blobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['mailbox', '-received_at'], name='email_mailbox_live_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailbox',
+            index=models.Index(fields=['expires_at'], name='mailbox_expires_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mailbox',
+            index=models.Index(fields=['created_at'], name='mailbox_created_at_idx'),
+        ),
+        migrations.RunPython(merge_case_duplicates, migrations.RunPython.noop),
+        migrations.RunSQL(
+            "UPDATE inbox_mailbox SET address = LOWER(address) WHERE address <> LOWER(address)",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='mailbox',
+            constraint=models.CheckConstraint(condition=models.Q(('address', django.db.models.functions.text.Lower('address'))), name='mailbox_address_lowercase'),
+        ),
+    ]
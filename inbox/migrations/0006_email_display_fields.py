@@ -0,0 +1,38 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0005_mailbox_email_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='display_html',
+            field=models.TextField(blank=True, default='', help_text='Sanitized HTML shown on the detail page'),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='display_html_blob',
+            field=models.CharField(blank=True, default='', help_text='Blob key when display_html is stored out of row', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='display_text',
+            field=models.TextField(blank=True, default='', help_text='Text shown on the detail page'),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='display_text_blob',
+            field=models.CharField(blank=True, default='', help_text='Blob key when display_text is stored out of row', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='email',
+            name='render_version',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Rendering pipeline version of the display fields, 0 if never rendered'),
+        ),
+    ]
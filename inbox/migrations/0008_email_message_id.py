@@ -0,0 +1,22 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inbox', '0007_attachment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='email',
+            name='message_id',
+            field=models.CharField(blank=True, default='', help_text='Message-ID header, used to drop resent copies', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='email',
+            index=models.Index(condition=models.Q(('message_id', ''), _negated=True), fields=['mailbox', 'message_id'], name='email_mailbox_message_id_idx'),
+        ),
+    ]
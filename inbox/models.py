@@ -3,9 +3,15 @@ import string
 from datetime import timedelta
 
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Lower
 from django.utils import timezone
 
+from . import blobs
+
+# Tries at a free generated address before giving up
+ADDRESS_ATTEMPTS = 5
+
 
 def generate_token():
     return secrets.token_urlsafe(32)
@@ -57,13 +63,22 @@ class Mailbox(models.Model):
 
     class Meta:
         verbose_name_plural = "mailboxes"
+        indexes = [
+            models.Index(fields=["expires_at"], name="mailbox_expires_at_idx"),
+            models.Index(fields=["created_at"], name="mailbox_created_at_idx"),
+        ]
+        constraints = [
+            # Lowercase storage lets address lookups use the unique index
+            models.CheckConstraint(condition=models.Q(address=Lower("address")), name="mailbox_address_lowercase"),
+        ]
 
     def __str__(self):
         return self.address
 
     def save(self, *args, **kwargs):
         # Auto-generate address if not set
-        if not self.address:
+        generated = not self.address
+        if generated:
             if not self.domain_id:
                 # Get or create the default domain from settings
                 default_domain_name = getattr(settings, "MAIL_DOMAIN", "voidmail.local")
@@ -72,7 +87,21 @@ class Mailbox(models.Model):
                     defaults={"is_active": True},
                 )
             self.address = f"{generate_local_part()}@{self.domain.name}"
-        super().save(*args, **kwargs)
+        # Stored lowercase so lookups can use the unique index on address
+        self.address = self.address.lower()
+        if not generated:
+            super().save(*args, **kwargs)
+            return
+        # A generated address can collide with a live one; pick another
+        for attempt in range(ADDRESS_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if attempt == ADDRESS_ATTEMPTS - 1:
+                    raise
+                self.address = f"{generate_local_part()}@{self.domain.name}".lower()
 
     @property
     def is_expired(self):
@@ -83,15 +112,79 @@ class Email(models.Model):
     mailbox = models.ForeignKey(Mailbox, on_delete=models.CASCADE, related_name="emails")
     sender = models.EmailField()
     recipient = models.EmailField()
+    message_id = models.CharField(max_length=255, blank=True, default="", help_text="Message-ID header, used to drop resent copies")
     subject = models.CharField(max_length=998, default="(no subject)")
+    snippet = models.CharField(max_length=200, blank=True, default="", help_text="Short plain-text preview")
     body_text = models.TextField(blank=True, default="")
     body_html = models.TextField(blank=True, default="")
+    body_text_blob = models.CharField(max_length=100, blank=True, default="", help_text="Blob key when body_text is stored out of row")
+    body_html_blob = models.CharField(max_length=100, blank=True, default="", help_text="Blob key when body_html is stored out of row")
+    raw_blob = models.CharField(max_length=100, blank=True, default="", help_text="Blob key of the raw RFC 822 message")
+    display_text = models.TextField(blank=True, default="", help_text="Text shown on the detail page")
+    display_html = models.TextField(blank=True, default="", help_text="Sanitized HTML shown on the detail page")
+    display_text_blob = models.CharField(max_length=100, blank=True, default="", help_text="Blob key when display_text is stored out of row")
+    display_html_blob = models.CharField(max_length=100, blank=True, default="", help_text="Blob key when display_html is stored out of row")
+    render_version = models.PositiveSmallIntegerField(default=0, help_text="Rendering pipeline version of the display fields, 0 if never rendered")
     received_at = models.DateTimeField(auto_now_add=True)
     size_bytes = models.PositiveIntegerField(default=0)
     is_deleted = models.BooleanField(default=False, help_text="Soft delete - hidden from UI but kept in database")
 
     class Meta:
         ordering = ["-received_at"]
+        indexes = [
+            # Inbox listing and polling: a mailbox's visible emails, newest first
+            models.Index(
+                fields=["mailbox", "-received_at"],
+                condition=models.Q(is_deleted=False),
+                name="email_mailbox_live_idx",
+            ),
+            # Duplicate check at ingest. Not unique: a partitioned inbox_email
+            # can only have unique indexes that include received_at
+            models.Index(
+                fields=["mailbox", "message_id"],
+                condition=~models.Q(message_id=""),
+                name="email_mailbox_message_id_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.sender} → {self.subject}"
+
+    def get_body_text(self):
+        if self.body_text_blob:
+            return blobs.read_text(self.body_text_blob)
+        return self.body_text
+
+    def get_body_html(self):
+        if self.body_html_blob:
+            return blobs.read_text(self.body_html_blob)
+        return self.body_html
+
+    def get_display_text(self):
+        if self.display_text_blob:
+            return blobs.read_text(self.display_text_blob)
+        return self.display_text
+
+    def get_display_html(self):
+        if self.display_html_blob:
+            return blobs.read_text(self.display_html_blob)
+        return self.display_html
+
+
+class Attachment(models.Model):
+    """A file attached to an email, stored as an uncompressed blob.
+
+    Identical files (such as one message sent to several mailboxes) share a
+    blob. The email link has no database constraint since a partitioned
+    ``inbox_email`` can't be referenced; rows go away with their mailbox.
+    """
+
+    mailbox = models.ForeignKey(Mailbox, on_delete=models.CASCADE, related_name="attachments")
+    email = models.ForeignKey(Email, on_delete=models.CASCADE, related_name="attachments", db_constraint=False)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255, default="application/octet-stream")
+    size_bytes = models.PositiveIntegerField(default=0)
+    blob = models.CharField(max_length=100, help_text="Blob key of the file content")
+
+    def __str__(self):
+        return self.filename
@@ -0,0 +1,134 @@
+"""Redis-backed caching of what the inbox and email pages read from the database.
+
+An email never changes after it is stored, except for being soft deleted, so
+its detail data is cached by id until its mailbox expires and dropped on
+delete. An inbox page is cached under the mailbox's change version from
+``mailbox_versions``, so new mail or a delete simply moves readers to a new
+key. The rendered rows and bodies are additionally cached as template
+fragments keyed by email id (see the ``email_row`` and ``email_body``
+fragments in the templates).
+"""
+
+import logging
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.paginator import Page, Paginator
+from django.utils import timezone
+
+from . import mailbox_versions, metrics, rendering
+from .models import Attachment, Email, Mailbox
+
+logger = logging.getLogger("voidmail.page_cache")
+
+KEY_PREFIX = "voidmail:page:"
+
+MAILBOX_FIELDS = ("id", "address", "domain_id", "token", "expires_at")
+DETAIL_FIELDS = (
+    "id", "mailbox_id", "sender", "recipient", "subject", "received_at", "size_bytes",
+    "display_text", "display_html", "display_text_blob", "display_html_blob", "raw_blob",
+)
+ATTACHMENT_FIELDS = ("id", "filename", "content_type", "size_bytes", "blob")
+ROW_FIELDS = ("id", "mailbox_id", "sender", "subject", "snippet", "received_at")
+
+def timeout_for(expires_at):
+    """Seconds to keep entries of a mailbox expiring at ``expires_at``."""
+    return max(1, int((expires_at - timezone.now()).total_seconds()))
+
+
+async def _aget(key, kind):
+    try:
+        value = await cache.aget(key)
+    except Exception:
+        logger.warning("Could not read %s from cache", key, exc_info=True)
+        value = None
+    metrics.PAGE_CACHE.labels(kind, "miss" if value is None else "hit").inc()
+    return value
+
+
+def _set(key, value, expires_at):
+    try:
+        cache.set(key, value, timeout=timeout_for(expires_at))
+    except Exception:
+        logger.warning("Could not write %s to cache", key, exc_info=True)
+
+
+def email_key(pk):
+    return f"{KEY_PREFIX}email:{pk}"
+
+
+def _load_email(pk):
+    email = Email.objects.select_related("mailbox").filter(pk=pk, is_deleted=False).first()
+    if email is None:
+        return None
+    fields = {field: getattr(email, field) for field in DETAIL_FIELDS}
+    if not email.render_version:
+        # Stored before rendering at ingest: render the bodies until
+        # rerender_emails brings the row up to date
+        rendered = rendering.render(email.get_body_text(), email.get_body_html())
+        fields.update(display_text=rendered.text, display_html=rendered.html)
+    data = {
+        "email": fields,
+        "mailbox": {field: getattr(email.mailbox, field) for field in MAILBOX_FIELDS},
+        "attachments": list(email.attachments.order_by("pk").values(*ATTACHMENT_FIELDS)),
+    }
+    _set(email_key(pk), data, email.mailbox.expires_at)
+    return data
+
+
+async def aget_email(pk):
+    """Return ``(email, mailbox, attachments)`` for a visible email, or None.
+
+    All are unsaved model instances rebuilt from the cached data; only the
+    fields the detail page needs are set.
+    """
+    data = await _aget(email_key(pk), "email")
+    if data is None:
+        data = await sync_to_async(_load_email)(pk)
+        if data is None:
+            return None
+    attachments = [Attachment(email_id=pk, **row) for row in data["attachments"]]
+    return Email(**data["email"]), Mailbox(**data["mailbox"]), attachments
+
+
+def invalidate_email(pk):
+    try:
+        cache.delete_many([
+            email_key(pk),
+            make_template_fragment_key("email_body", [pk]),
+            make_template_fragment_key("email_row", [pk]),
+        ])
+    except Exception:
+        logger.warning("Could not invalidate cached email %s", pk, exc_info=True)
+
+
+async def aget_inbox_page(token, page_number, per_page, load):
+    """Return ``(mailbox, page)`` for an inbox, cached under its change version.
+
+    ``await load()`` returns the same pair from the database, with the
+    page's emails already fetched, and is used directly when Redis doesn't
+    know the mailbox's version.
+    """
+    state = await mailbox_versions.aget_state(token)
+    if state is None:
+        return await load()
+    number = page_number if page_number and page_number.isdigit() else "1"
+    key = f"{KEY_PREFIX}inbox:{token}:{state['version']}:{number}"
+    data = await _aget(key, "inbox")
+    if data is None:
+        mailbox, page = await load()
+        if mailbox.pk is None:
+            return mailbox, page
+        data = {
+            "mailbox": {field: getattr(mailbox, field) for field in MAILBOX_FIELDS},
+            "count": page.paginator.count,
+            "number": page.number,
+            "rows": [{field: getattr(email, field) for field in ROW_FIELDS} for email in page.object_list],
+        }
+        await sync_to_async(_set)(key, data, mailbox.expires_at)
+        return mailbox, page
+    # The paginator only needs the total for its page links
+    paginator = Paginator(range(data["count"]), per_page)
+    rows = [Email(**row) for row in data["rows"]]
+    return Mailbox(**data["mailbox"]), Page(rows, data["number"], paginator)
@@ -0,0 +1,131 @@
+"""MIME parsing for incoming mail.
+
+Kept free of Django imports so it can run in a ``ProcessPoolExecutor`` worker
+without setting up the project. The display versions of the bodies are
+rendered here too, while the message's inline parts are at hand.
+"""
+
+import email
+import email.policy
+import html
+import re
+from dataclasses import dataclass
+
+from .rendering import render
+
+SNIPPET_LENGTH = 160
+
+# Longer Message-IDs are not kept, so they never match another message
+MAX_MESSAGE_ID_LENGTH = 255
+
+_INVISIBLE_HTML = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_TAG = re.compile(r"<[^>]*>")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@dataclass
+class ParsedAttachment:
+    filename: str
+    content_type: str
+    data: bytes
+
+
+@dataclass
+class ParsedMessage:
+    from_header: str
+    message_id: str
+    subject: str
+    body_text: str
+    body_html: str
+    snippet: str
+    display_text: str
+    display_html: str
+    attachments: list
+
+
+def make_snippet(body_text, body_html, length=SNIPPET_LENGTH):
+    """Short single-line preview, from the text body or else the HTML body."""
+    text = body_text
+    if not text.strip() and body_html:
+        text = html.unescape(_TAG.sub(" ", _INVISIBLE_HTML.sub(" ", body_html)))
+    text = _WHITESPACE.sub(" ", text).strip()
+    if len(text) > length:
+        text = text[:length - 1].rstrip() + "…"
+    return text
+
+
+def _get_text(part):
+    try:
+        return part.get_content()
+    except (LookupError, UnicodeError):
+        # Unknown or lying charset: decode what we can instead of failing the message
+        payload = part.get_payload(decode=True) or b""
+        return payload.decode("utf-8", errors="replace")
+
+
+def _is_attachment(part):
+    if part.is_multipart():
+        return False
+    if part.get_content_disposition() == "attachment":
+        return True
+    # Named parts are files, unless the HTML body shows them by Content-ID
+    return part.get_filename() is not None and part.get("Content-ID") is None
+
+
+def _get_attachment(part, number):
+    # Only the printable base name, in case a sender puts a path or line breaks in it
+    filename = "".join(char for char in part.get_filename() or "" if char.isprintable())
+    filename = filename.replace("\\", "/").rsplit("/", 1)[-1]
+    return ParsedAttachment(
+        filename=filename[:255] or f"attachment-{number}",
+        content_type=part.get_content_type()[:255],
+        data=part.get_payload(decode=True) or b"",
+    )
+
+
+def parse_message(raw):
+    """Parse raw RFC 822 bytes and extract the fields VoidMail stores."""
+    msg = email.message_from_bytes(raw, policy=email.policy.default)
+    subject = msg.get("Subject", "(no subject)") or "(no subject)"
+
+    body_text = ""
+    body_html = ""
+    # {Content-ID: (content type, bytes)}, for images the HTML body shows inline
+    inline_images = {}
+    attachments = []
+
+    if msg.is_multipart():
+        for part in msg.walk():
+            ct = part.get_content_type()
+            if _is_attachment(part):
+                attachments.append(_get_attachment(part, len(attachments) + 1))
+            elif ct == "text/plain" and not body_text:
+                body_text = _get_text(part)
+            elif ct == "text/html" and not body_html:
+                body_html = _get_text(part)
+            elif part.get_content_maintype() == "image" and part.get("Content-ID"):
+                inline_images[str(part["Content-ID"])] = (ct, part.get_payload(decode=True) or b"")
+    elif _is_attachment(msg) or msg.get_content_maintype() != "text":
+        # A lone file (a scanner's PDF, a bare image) leaves the body empty
+        attachments.append(_get_attachment(msg, 1))
+    elif msg.get_content_type() == "text/html":
+        body_html = _get_text(msg)
+    else:
+        body_text = _get_text(msg)
+
+    message_id = str(msg.get("Message-ID", "")).strip()
+    if len(message_id) > MAX_MESSAGE_ID_LENGTH:
+        message_id = ""
+
+    rendered = render(body_text, body_html, inline_images)
+    return ParsedMessage(
+        from_header=str(msg.get("From", "")),
+        message_id=message_id,
+        subject=str(subject),
+        body_text=body_text,
+        body_html=body_html,
+        snippet=make_snippet(body_text, body_html),
+        display_text=rendered.text,
+        display_html=rendered.html,
+        attachments=attachments,
+    )
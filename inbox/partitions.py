@@ -0,0 +1,217 @@
+"""Optional PostgreSQL range partitioning of ``inbox_email`` on ``received_at``.
+
+Every mailbox is short-lived, so the email table is a rolling window. Once
+converted with ``manage.py email_partitions --convert``, expiry drops whole
+partitions instead of deleting rows, which leaves no dead tuples to vacuum.
+
+A partition covering ``[start, end)`` can only hold emails of mailboxes
+created before ``end``, so it is dropped once none of those is still live.
+A default partition catches rows outside the pre-created ranges; it should
+stay empty as long as ``ensure_upcoming`` runs regularly.
+"""
+
+import logging
+import re
+from datetime import UTC, datetime, timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .models import Email, Mailbox
+
+logger = logging.getLogger("voidmail.partitions")
+
+PARENT_TABLE = Email._meta.db_table
+DEFAULT_PARTITION = f"{PARENT_TABLE}_default"
+PARTITION_KEY = "received_at"
+
+# Don't stall ingest behind a partition DDL waiting for its lock
+DDL_LOCK_TIMEOUT = "5s"
+
+_BOUNDS_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def interval():
+    return timedelta(hours=settings.EMAIL_PARTITION_HOURS)
+
+
+def partition_start(moment):
+    """Start of the partition containing ``moment``, aligned to the Unix epoch."""
+    step = interval().total_seconds()
+    return datetime.fromtimestamp(moment.timestamp() // step * step, tz=UTC)
+
+
+def partition_name(start):
+    return f"{PARENT_TABLE}_p{start:%Y%m%d%H}"
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+            [PARENT_TABLE],
+        )
+        return cursor.fetchone() is not None
+
+
+def list_partitions():
+    """Return ``(name, start, end)`` for each range partition, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = %s::regclass
+            """,
+            [PARENT_TABLE],
+        )
+        rows = cursor.fetchall()
+    partitions = []
+    for name, bound in rows:
+        match = _BOUNDS_RE.search(bound)
+        if match:
+            start, end = (datetime.fromisoformat(value) for value in match.groups())
+            partitions.append((name, start, end))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def _create_partition(cursor, start):
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {_quote(partition_name(start))} "
+        f"PARTITION OF {_quote(PARENT_TABLE)} FOR VALUES FROM (%s) TO (%s)",
+        [start, start + interval()],
+    )
+
+
+def ensure_upcoming(now=None, ahead=None):
+    """Create the current partition and the next ``ahead`` ones. Returns the names created."""
+    now = now or timezone.now()
+    ahead = settings.EMAIL_PARTITIONS_AHEAD if ahead is None else ahead
+    existing = {name for name, _, _ in list_partitions()}
+    created = []
+    start = partition_start(now)
+    for i in range(ahead + 1):
+        name = partition_name(start + i * interval())
+        if name in existing:
+            continue
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'")
+                _create_partition(cursor, start + i * interval())
+        except DatabaseError:
+            # Typically rows for this range already landed in the default partition
+            logger.warning("Could not create partition %s", name, exc_info=True)
+            continue
+        created.append(name)
+    return created
+
+
+def drop_expired(now=None):
+    """Drop partitions that can no longer hold a live mailbox's emails. Returns the names dropped."""
+    now = now or timezone.now()
+    dropped = []
+    for name, _, end in list_partitions():
+        if end > now or Mailbox.objects.filter(created_at__lt=end, expires_at__gt=now).exists():
+            # Partitions are checked oldest first, and a later one can't be freer
+            break
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'")
+                cursor.execute(f"DROP TABLE {_quote(name)}")
+        except DatabaseError:
+            logger.warning("Could not drop partition %s", name, exc_info=True)
+            break
+        dropped.append(name)
+    return dropped
+
+
+def purge_default(now=None):
+    """Delete rows of expired mailboxes that fell into the default partition."""
+    now = now or timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            DELETE FROM {_quote(DEFAULT_PARTITION)} AS email
+            USING {_quote(Mailbox._meta.db_table)} AS mailbox
+            WHERE mailbox.id = email.mailbox_id AND mailbox.expires_at <= %s
+            """,
+            [now],
+        )
+        return cursor.rowcount
+
+
+def convert(ahead=None):
+    """Rebuild ``inbox_email`` as a partitioned table, keeping its rows, indexes and constraints.
+
+    Runs in one transaction holding an exclusive lock on the table, so stop
+    the SMTP server first on a large table. Returns the number of rows copied.
+    """
+    old_table = f"{PARENT_TABLE}_unpartitioned"
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {_quote(PARENT_TABLE)} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            """
+            SELECT indexdef, indisunique FROM pg_indexes
+            JOIN pg_index ON pg_index.indexrelid = (quote_ident(pg_indexes.schemaname) || '.' || quote_ident(indexname))::regclass
+            WHERE tablename = %s AND NOT indisprimary
+            """,
+            [PARENT_TABLE],
+        )
+        indexes = cursor.fetchall()
+        unique = [definition for definition, is_unique in indexes if is_unique]
+        if unique:
+            # A unique index on a partitioned table has to include the partition key
+            raise DatabaseError(f"Can't partition {PARENT_TABLE} with unique indexes: {unique}")
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f'
+            """,
+            [PARENT_TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE contype = 'p' AND conrelid = %s::regclass",
+            [PARENT_TABLE],
+        )
+        (primary_key,) = cursor.fetchone()
+        cursor.execute(f"SELECT min({PARTITION_KEY}) FROM {_quote(PARENT_TABLE)}")
+        (oldest,) = cursor.fetchone()
+
+        cursor.execute(f"ALTER TABLE {_quote(PARENT_TABLE)} RENAME TO {_quote(old_table)}")
+        cursor.execute(f"ALTER TABLE {_quote(old_table)} RENAME CONSTRAINT {_quote(primary_key)} TO {_quote(old_table + '_pkey')}")
+        cursor.execute(
+            f"CREATE TABLE {_quote(PARENT_TABLE)} (LIKE {_quote(old_table)} "
+            f"INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY) "
+            f"PARTITION BY RANGE ({PARTITION_KEY})"
+        )
+        cursor.execute(f"ALTER TABLE {_quote(PARENT_TABLE)} ADD CONSTRAINT {_quote(primary_key)} PRIMARY KEY (id, {PARTITION_KEY})")
+        cursor.execute(f"CREATE TABLE {_quote(DEFAULT_PARTITION)} PARTITION OF {_quote(PARENT_TABLE)} DEFAULT")
+
+        now = timezone.now()
+        start = partition_start(oldest or now)
+        last = partition_start(now) + (settings.EMAIL_PARTITIONS_AHEAD if ahead is None else ahead) * interval()
+        while start <= last:
+            _create_partition(cursor, start)
+            start += interval()
+
+        cursor.execute(f"INSERT INTO {_quote(PARENT_TABLE)} SELECT * FROM {_quote(old_table)}")
+        copied = cursor.rowcount
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), coalesce(max(id), 0) + 1, false) FROM {_quote(PARENT_TABLE)}",
+            [PARENT_TABLE],
+        )
+        cursor.execute(f"DROP TABLE {_quote(old_table)}")
+        for definition, _ in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {_quote(PARENT_TABLE)} ADD CONSTRAINT {_quote(name)} {definition}")
+    return copied
@@ -0,0 +1,22 @@
+"""Shared Redis clients for data structures the Django cache API lacks."""
+
+import functools
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+
+@functools.cache
+def get_redis():
+    return redis.Redis.from_url(settings.REDIS_URL)
+
+
+@functools.cache
+def get_async_redis():
+    # Thousands of concurrent requests share a bounded set of connections,
+    # waiting for one rather than failing once the pool is exhausted
+    pool = redis.asyncio.BlockingConnectionPool.from_url(
+        settings.REDIS_URL, max_connections=settings.REDIS_ASYNC_MAX_CONNECTIONS, timeout=5,
+    )
+    return redis.asyncio.Redis(connection_pool=pool)
@@ -0,0 +1,109 @@
+"""Display-ready versions of a message's bodies, computed once at ingest.
+
+The HTML body is sanitized with nh3: scripts, style sheets, forms and event
+handlers are dropped, remote images are blocked (they are mostly tracking
+pixels) and images referenced as ``cid:`` are inlined from the message's own
+parts as ``data:`` URIs. The text version is the text body, or text extracted
+from the HTML when the message has none.
+
+Like ``parsing``, this is kept free of Django imports so it runs in the parse
+workers. Bump ``RENDER_VERSION`` whenever the output changes, then run
+``manage.py rerender_emails`` to bring stored emails up to date.
+"""
+
+import base64
+import html
+import re
+from dataclasses import dataclass
+
+import nh3
+
+RENDER_VERSION = 1
+
+# Larger inline images are dropped rather than bloating the stored HTML
+MAX_INLINE_IMAGE_BYTES = 512 * 1024
+
+ALLOWED_TAGS = nh3.ALLOWED_TAGS | {"center", "font"}
+ALLOWED_ATTRIBUTES = {
+    **nh3.ALLOWED_ATTRIBUTES,
+    "*": {"align", "bgcolor", "dir", "height", "lang", "style", "title", "valign", "width"},
+    "font": {"color", "face", "size"},
+    "table": {"border", "cellpadding", "cellspacing"},
+    "td": {"colspan", "rowspan", "nowrap"},
+    "th": {"colspan", "rowspan", "nowrap"},
+}
+# Only properties that can't load anything; no background images or @imports
+ALLOWED_STYLE_PROPERTIES = {
+    "background-color", "border", "border-bottom", "border-collapse", "border-color", "border-left",
+    "border-radius", "border-right", "border-spacing", "border-style", "border-top", "border-width",
+    "color", "display", "float", "font", "font-family", "font-size", "font-style", "font-weight",
+    "height", "letter-spacing", "line-height", "margin", "margin-bottom", "margin-left", "margin-right",
+    "margin-top", "max-width", "min-width", "padding", "padding-bottom", "padding-left", "padding-right",
+    "padding-top", "text-align", "text-decoration", "text-transform", "vertical-align", "white-space",
+    "width",
+}
+URL_SCHEMES = {"http", "https", "mailto", "tel", "cid", "data"}
+
+_BLOCK_END = re.compile(r"<br\s*/?>|</(p|div|tr|li|h[1-6]|table|blockquote)\s*>", re.IGNORECASE)
+_TAG = re.compile(r"<[^>]*>")
+_SPACES = re.compile(r"[ \t\r\f\v]+")
+_BLANK_LINES = re.compile(r"\n\s*\n\s*\n+")
+
+
+@dataclass
+class Rendered:
+    html: str
+    text: str
+
+
+def _content_id(value):
+    return value.strip().strip("<>").lower()
+
+
+def _attribute_filter(inline_images):
+    def keep(element, attribute, value):
+        if element == "img" and attribute == "src":
+            if value.lower().startswith("cid:"):
+                return inline_images.get(_content_id(value[4:]))
+            if value.lower().startswith("data:image/"):
+                return value
+            # Remote image: blocked
+            return None
+        if attribute in ("href", "src") and value.lower().startswith(("cid:", "data:")):
+            return None
+        return value
+    return keep
+
+
+def sanitize_html(body_html, inline_images=None):
+    """Sanitize ``body_html``, inlining ``{content id: (content type, bytes)}`` images."""
+    data_uris = {
+        _content_id(content_id): f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+        for content_id, (content_type, data) in (inline_images or {}).items()
+        if content_type.startswith("image/") and len(data) <= MAX_INLINE_IMAGE_BYTES
+    }
+    return nh3.clean(
+        body_html,
+        tags=ALLOWED_TAGS,
+        clean_content_tags={"script", "style"},
+        attributes=ALLOWED_ATTRIBUTES,
+        attribute_filter=_attribute_filter(data_uris),
+        url_schemes=URL_SCHEMES,
+        filter_style_properties=ALLOWED_STYLE_PROPERTIES,
+        set_tag_attribute_values={"a": {"target": "_blank"}},
+        strip_comments=True,
+    ).strip()
+
+
+def html_to_text(body_html):
+    """Plain text from (sanitized) HTML: block ends become line breaks, tags are dropped."""
+    text = html.unescape(_TAG.sub("", _BLOCK_END.sub("\n", body_html)))
+    text = "\n".join(_SPACES.sub(" ", line).strip() for line in text.splitlines())
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def render(body_text, body_html, inline_images=None):
+    """Return the ``Rendered`` HTML and text to display for a message."""
+    display_html = sanitize_html(body_html, inline_images) if body_html else ""
+    display_text = body_text if body_text.strip() else html_to_text(display_html)
+    return Rendered(html=display_html, text=display_text)
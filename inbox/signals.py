@@ -0,0 +1,24 @@
+"""Signal handlers keeping shared caches in sync with the database."""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import domains, mailbox_index, mailbox_versions
+from .models import Domain, Mailbox
+
+
+@receiver([post_save, post_delete], sender=Domain)
+def domain_changed(sender, **kwargs):
+    domains.bump_version()
+
+
+@receiver(post_save, sender=Mailbox)
+def mailbox_saved(sender, instance, created, **kwargs):
+    mailbox_index.add(instance.address, instance.expires_at)
+    mailbox_versions.saved(instance.token, instance.expires_at, created)
+
+
+@receiver(post_delete, sender=Mailbox)
+def mailbox_deleted(sender, instance, **kwargs):
+    mailbox_index.remove(instance.address)
+    mailbox_versions.deleted(instance.token)
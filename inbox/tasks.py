@@ -5,19 +5,39 @@ from datetime import timedelta
 from django.tasks import task
 from django_scheduled_tasks.base import periodic_task
 
+PURGE_INTERVAL = timedelta(hours=1)
+
 
 @task
-def purge_empty_mailboxes_task(hours: int = 1) -> str:
-    """Task to purge empty mailboxes older than specified hours."""
+def purge_empty_mailboxes_task(hours: int = 1, max_runtime: int = int(PURGE_INTERVAL.total_seconds() * 0.8)) -> str:
+    """Task to purge empty mailboxes older than specified hours.
+
+    Stops after ``max_runtime`` seconds so a run never overlaps the next one.
+    """
     from django.core.management import call_command
     from django.utils import timezone
     
-    call_command("purge_empty_mailboxes", hours=hours)
+    call_command("purge_empty_mailboxes", hours=hours, max_runtime=max_runtime)
     return f"Purge completed at {timezone.now()}"
 
 
 # Register the task to run every hour
 periodic_task(
-    interval=timedelta(hours=1),
+    interval=PURGE_INTERVAL,
     task=purge_empty_mailboxes_task,
 )
+
+
+@task
+def refill_address_pools_task() -> str:
+    """Task to top up the pre-generated address pools of active domains."""
+    from inbox import address_pool
+
+    added = address_pool.refill_all()
+    return f"Added {added} pooled address(es)"
+
+
+periodic_task(
+    interval=timedelta(seconds=30),
+    task=refill_address_pools_task,
+)
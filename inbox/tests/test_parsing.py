@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from inbox.parsing import parse_message
+
+
+def single_part(content_type, body, headers=""):
+    return (
+        "From: sender@example.com\r\n"
+        "Subject: Scan\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"{headers}"
+        "\r\n"
+        f"{body}\r\n"
+    ).encode()
+
+
+class SinglePartMessageTests(TestCase):
+    def test_pdf_is_an_attachment(self):
+        parsed = parse_message(single_part(
+            'application/pdf; name="scan.pdf"', "JVBERi0xLjQK",
+            "Content-Transfer-Encoding: base64\r\n",
+        ))
+        self.assertEqual(parsed.body_text, "")
+        self.assertEqual(parsed.body_html, "")
+        self.assertEqual(parsed.snippet, "")
+        self.assertEqual(len(parsed.attachments), 1)
+        attachment = parsed.attachments[0]
+        self.assertEqual(attachment.filename, "scan.pdf")
+        self.assertEqual(attachment.content_type, "application/pdf")
+        self.assertEqual(attachment.data, b"%PDF-1.4\n")
+
+    def test_unnamed_image_is_an_attachment(self):
+        parsed = parse_message(single_part(
+            "image/png", "iVBORw0KGgo=", "Content-Transfer-Encoding: base64\r\n",
+        ))
+        self.assertEqual(parsed.body_text, "")
+        self.assertEqual(len(parsed.attachments), 1)
+        self.assertEqual(parsed.attachments[0].filename, "attachment-1")
+        self.assertEqual(parsed.attachments[0].data, b"\x89PNG\r\n\x1a\n")
+
+    def test_text_is_the_body(self):
+        parsed = parse_message(single_part("text/plain; charset=utf-8", "Hello there"))
+        self.assertEqual(parsed.body_text.strip(), "Hello there")
+        self.assertEqual(parsed.snippet, "Hello there")
+        self.assertEqual(parsed.attachments, [])
+
+    def test_html_is_the_body(self):
+        parsed = parse_message(single_part("text/html; charset=utf-8", "<p>Hello</p>"))
+        self.assertEqual(parsed.body_html.strip(), "<p>Hello</p>")
+        self.assertEqual(parsed.snippet, "Hello")
+        self.assertEqual(parsed.attachments, [])
@@ -0,0 +1,25 @@
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase
+
+from inbox.benchmarks.explain import hot_queries, seed
+
+
+@skipUnless(connection.vendor == "postgresql", "EXPLAIN output is PostgreSQL specific")
+class HotQueryPlanTests(TestCase):
+    """Each hot query must keep using an index on a realistically sized table."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.mailbox, cls.now = seed(5000, 3)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE inbox_mailbox")
+            cursor.execute("ANALYZE inbox_email")
+
+    def test_hot_queries_use_indexes(self):
+        for label, (table, queryset) in hot_queries(self.mailbox, self.now).items():
+            with self.subTest(label):
+                plan = queryset.explain()
+                self.assertIn("Index", plan)
+                self.assertNotIn(f"Seq Scan on {table}", plan)
@@ -0,0 +1,98 @@
+from unittest import TestCase
+
+from inbox.rendering import MAX_INLINE_IMAGE_BYTES, html_to_text, render, sanitize_html
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+
+class SanitizeHtmlTests(TestCase):
+    def test_scripts_and_style_sheets_are_removed_with_their_content(self):
+        cleaned = sanitize_html(
+            "<style>p { color: red }</style><p>Hi</p><script>alert('x')</script>",
+        )
+        self.assertEqual(cleaned, "<p>Hi</p>")
+
+    def test_event_handlers_are_removed(self):
+        cleaned = sanitize_html('<p onclick="steal()" onmouseover="steal()">Hi</p><img src="x" onerror="steal()">')
+        self.assertNotIn("steal", cleaned)
+        self.assertIn("<p>Hi</p>", cleaned)
+
+    def test_forms_and_frames_are_removed(self):
+        cleaned = sanitize_html('<form action="https://evil.example"><input name="pw"></form><iframe src="https://evil.example"></iframe>')
+        self.assertNotIn("form", cleaned)
+        self.assertNotIn("input", cleaned)
+        self.assertNotIn("iframe", cleaned)
+
+    def test_style_properties_that_load_resources_are_removed(self):
+        cleaned = sanitize_html('<p style="color: red; background-image: url(https://tracker.example/p.gif)">Hi</p>')
+        self.assertIn("color:red", cleaned.replace(" ", ""))
+        self.assertNotIn("tracker", cleaned)
+
+    def test_remote_images_are_blocked(self):
+        cleaned = sanitize_html('<img src="https://tracker.example/pixel.gif" alt="logo">')
+        self.assertNotIn("tracker", cleaned)
+        self.assertNotIn("src", cleaned)
+
+    def test_cid_images_are_inlined_as_data_uris(self):
+        cleaned = sanitize_html('<img src="cid:Logo@Example">', {"<logo@example>": ("image/png", PNG)})
+        self.assertIn('src="data:image/png;base64,iVBORw0KGgo="', cleaned)
+
+    def test_unknown_cid_images_are_dropped(self):
+        cleaned = sanitize_html('<img src="cid:missing@example">', {"<logo@example>": ("image/png", PNG)})
+        self.assertNotIn("src", cleaned)
+
+    def test_inline_images_over_the_size_limit_are_dropped(self):
+        images = {
+            "<small@example>": ("image/png", b"x" * MAX_INLINE_IMAGE_BYTES),
+            "<large@example>": ("image/png", b"x" * (MAX_INLINE_IMAGE_BYTES + 1)),
+        }
+        cleaned = sanitize_html('<img src="cid:small@example"><img src="cid:large@example">', images)
+        self.assertEqual(cleaned.count("data:image/png"), 1)
+
+    def test_inline_parts_that_are_not_images_are_not_inlined(self):
+        cleaned = sanitize_html('<img src="cid:page@example">', {"<page@example>": ("text/html", b"<p>x</p>")})
+        self.assertNotIn("data:", cleaned)
+
+    def test_data_and_cid_links_are_removed(self):
+        cleaned = sanitize_html(
+            '<a href="data:text/html;base64,PHNjcmlwdD4=">one</a><a href="cid:part@example">two</a>',
+            {"<part@example>": ("image/png", PNG)},
+        )
+        self.assertNotIn("data:", cleaned)
+        self.assertNotIn("cid:", cleaned)
+        self.assertNotIn("href", cleaned)
+
+    def test_javascript_links_are_removed(self):
+        cleaned = sanitize_html('<a href="javascript:steal()">click</a>')
+        self.assertNotIn("javascript", cleaned)
+
+    def test_links_open_in_a_new_tab(self):
+        cleaned = sanitize_html('<a href="https://example.com/">site</a>')
+        self.assertIn('href="https://example.com/"', cleaned)
+        self.assertIn('target="_blank"', cleaned)
+
+
+class HtmlToTextTests(TestCase):
+    def test_block_ends_become_line_breaks(self):
+        text = html_to_text("<h1>Title</h1><p>First &amp; <b>bold</b></p><div>Second<br>Third</div>")
+        self.assertEqual(text, "Title\nFirst & bold\nSecond\nThird")
+
+    def test_blank_lines_are_collapsed(self):
+        self.assertEqual(html_to_text("<p>One</p><p></p><p></p><p></p><p>Two</p>"), "One\n\nTwo")
+
+
+class RenderTests(TestCase):
+    def test_text_body_is_shown_as_is(self):
+        rendered = render("Plain text", "<p>HTML</p>")
+        self.assertEqual(rendered.text, "Plain text")
+        self.assertEqual(rendered.html, "<p>HTML</p>")
+
+    def test_text_falls_back_to_the_sanitized_html(self):
+        rendered = render("  ", "<p>Hello</p><script>alert('x')</script>")
+        self.assertEqual(rendered.text, "Hello")
+        self.assertNotIn("script", rendered.html)
+
+    def test_no_html_body(self):
+        rendered = render("Only text", "")
+        self.assertEqual(rendered.html, "")
+        self.assertEqual(rendered.text, "Only text")
@@ -9,8 +9,12 @@ urlpatterns = [
     path("create/", views.create_mailbox, name="create_mailbox"),
     path("inbox/<str:token>/", views.inbox_view, name="inbox_view"),
     path("inbox/<str:token>/check/", views.check_emails, name="check_emails"),
+    path("inbox/<str:token>/events/", views.email_events, name="email_events"),
     path("email/<int:pk>/", views.email_detail, name="email_detail"),
+    path("email/<int:pk>/source/", views.email_source, name="email_source"),
+    path("email/<int:pk>/attachments/<int:attachment_id>/", views.attachment_download, name="attachment_download"),
     path("email/<int:pk>/delete/", views.delete_email, name="delete_email"),
     path("new/", views.new_mailbox, name="new_mailbox"),
     path("health/", views.health_check, name="health_check"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
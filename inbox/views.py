@@ -1,131 +1,339 @@
-from django.http import JsonResponse
-from django.shortcuts import get_object_or_404, redirect, render
+import asyncio
+import time
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connection
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import aget_object_or_404, redirect, render
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import content_disposition_header, parse_etags, quote_etag
 from django.views.decorators.http import require_POST
 
-from .models import Domain, Email, Mailbox
+from . import (
+    address_pool,
+    blobs,
+    events,
+    lazy_mailboxes,
+    mailbox_versions,
+    metrics,
+    page_cache,
+)
+from .domains import registry
+from .models import Email, Mailbox
+
+# Columns needed to list emails; bodies are only loaded by email_detail
+SUMMARY_FIELDS = ("id", "mailbox", "sender", "subject", "snippet", "received_at")
+
+
+async def _new_mailbox(domain):
+    """Mint a signed lazy mailbox, or create the row from a pooled address."""
+    if domain is None:
+        return await Mailbox.objects.acreate(domain=domain)
+    if settings.LAZY_MAILBOXES:
+        return lazy_mailboxes.generate(domain)
+    return await address_pool.acreate_mailbox(domain)
+
+
+async def _get_domain(domain_id):
+    """Return the requested active domain, or the default one if none was picked."""
+    await registry.arefresh_if_due()
+    if not domain_id:
+        return registry.default
+    domain = registry.get(domain_id)
+    if domain is None:
+        raise Http404("No Domain matches the given query.")
+    return domain
 
 
-def home(request):
+async def _get_mailbox(token):
+    """Return the mailbox for ``token``; unsaved for a lazy mailbox without a row yet."""
+    mailbox = await Mailbox.objects.filter(token=token).afirst()
+    if mailbox is None and settings.LAZY_MAILBOXES:
+        await registry.arefresh_if_due()
+        mailbox = lazy_mailboxes.from_token(token)
+    if mailbox is None:
+        raise Http404("No mailbox matches the given query.")
+    return mailbox
+
+
+async def _render(request, template_name, context):
+    # Templates read cached fragments and, on a miss, blob storage; both block
+    return await sync_to_async(render, thread_sensitive=False)(request, template_name, context)
+
+
+async def home(request):
     """Auto-create a mailbox and redirect to inbox — tempmail-style instant start."""
-    domain = Domain.objects.filter(is_active=True, is_default=True).first() or Domain.objects.filter(is_active=True).first()
-    mailbox = Mailbox.objects.create(domain=domain)
+    mailbox = await _new_mailbox((await registry.arefresh_if_due()).default)
     return redirect("inbox:inbox_view", token=mailbox.token)
 
 
 @require_POST
-def create_mailbox(request):
+async def create_mailbox(request):
     """Create a mailbox with optional custom name and domain."""
     domain_id = request.POST.get("domain")
     name = request.POST.get("name", "").strip().lower()
 
-    domain = None
-    if domain_id:
-        domain = get_object_or_404(Domain, id=domain_id, is_active=True)
-    else:
-        domain = Domain.objects.filter(is_active=True, is_default=True).first() or Domain.objects.filter(is_active=True).first()
+    domain = await _get_domain(domain_id)
 
     if name:
         address = f"{name}@{domain.name}"
         # Check if address is taken by a non-expired mailbox
-        existing = Mailbox.objects.filter(address=address, expires_at__gt=timezone.now()).first()
+        existing = await Mailbox.objects.filter(address=address, expires_at__gt=timezone.now()).afirst()
         if existing:
             return redirect("inbox:inbox_view", token=existing.token)
         # Clean up any expired mailbox with this address
-        Mailbox.objects.filter(address=address, expires_at__lte=timezone.now()).delete()
+        await Mailbox.objects.filter(address=address, expires_at__lte=timezone.now()).adelete()
         mailbox = Mailbox(domain=domain, address=address)
-        mailbox.save()
+        await mailbox.asave()
     else:
-        mailbox = Mailbox.objects.create(domain=domain)
+        mailbox = await _new_mailbox(domain)
 
     return redirect("inbox:inbox_view", token=mailbox.token)
 
 
-def inbox_view(request, token):
+def _paginate(mailbox, page_number):
+    if mailbox.pk is None:
+        emails = Email.objects.none()
+    else:
+        emails = mailbox.emails.filter(is_deleted=False).only(*SUMMARY_FIELDS)
+    page = Paginator(emails, settings.INBOX_PAGE_SIZE).get_page(page_number)
+    # Fetched here, as the template doesn't run in this thread
+    page.object_list = list(page.object_list)
+    return page
+
+
+async def _load_inbox(token, page_number):
+    mailbox = await _get_mailbox(token)
+    return mailbox, await sync_to_async(_paginate)(mailbox, page_number)
+
+
+async def inbox_view(request, token):
     """Display the inbox for a mailbox."""
-    mailbox = get_object_or_404(Mailbox, token=token)
-    emails = mailbox.emails.filter(is_deleted=False)
+    page_number = request.GET.get("page")
+    mailbox, page = await page_cache.aget_inbox_page(
+        token, page_number, settings.INBOX_PAGE_SIZE, lambda: _load_inbox(token, page_number),
+    )
     now = timezone.now()
     remaining = max(0, int((mailbox.expires_at - now).total_seconds()))
 
     # Split address into local part and domain for the editable input
     local_part, _ = mailbox.address.split("@", 1)
 
-    domains = Domain.objects.filter(is_active=True)
-
-    return render(request, "inbox/inbox.html", {
+    return await _render(request, "inbox/inbox.html", {
         "mailbox": mailbox,
-        "emails": emails,
+        "page": page,
         "remaining_seconds": remaining,
-        "domains": domains,
+        "domains": (await registry.arefresh_if_due()).active,
         "local_part": local_part,
+        "cache_timeout": page_cache.timeout_for(mailbox.expires_at),
     })
 
 
-def check_emails(request, token):
-    """JSON polling endpoint — returns new email count and list."""
-    mailbox = get_object_or_404(Mailbox, token=token)
+def _parse_since(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _conditional(response, etag):
+    """Tag a polling response so clients revalidate it with If-None-Match."""
+    if etag is not None:
+        response["ETag"] = etag
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+async def check_emails(request, token):
+    """JSON polling endpoint — returns new email count and list.
+
+    While Redis holds the mailbox's state, unchanged polls are answered from
+    it alone: 304 if the client's ETag is current, or an empty delta if
+    nothing arrived after ``since``.
+    """
+    since = _parse_since(request.GET.get("since"))
+    state = await mailbox_versions.aget_state(token)
+    etag = None
+    if state is not None:
+        if state["expires"] <= time.time():
+            metrics.POLLS_EXPIRED.inc()
+            return JsonResponse({"expired": True, "emails": []})
+        etag = quote_etag(str(state["version"]))
+        client_etags = parse_etags(request.headers.get("If-None-Match", ""))
+        if etag in client_etags or "*" in client_etags:
+            metrics.POLLS_NOT_MODIFIED.inc()
+            return _conditional(HttpResponseNotModified(), etag)
+        if since is not None and timezone.is_aware(since) and since.timestamp() >= state["latest"]:
+            metrics.POLLS_UNCHANGED.inc()
+            return _conditional(JsonResponse({"expired": False, "count": state["count"], "emails": []}), etag)
+
+    mailbox = await _get_mailbox(token)
     if mailbox.is_expired:
+        metrics.POLLS_EXPIRED.inc()
         return JsonResponse({"expired": True, "emails": []})
+    metrics.POLLS_DATABASE.inc()
+    if mailbox.pk is None:
+        return JsonResponse({"expired": False, "count": 0, "emails": []})
 
-    since = request.GET.get("since")
     emails = mailbox.emails.filter(is_deleted=False)
-    if since:
-        try:
-            from datetime import datetime
-            since_dt = datetime.fromisoformat(since)
-            emails = emails.filter(received_at__gt=since_dt)
-        except (ValueError, TypeError):
-            pass
-
-    return JsonResponse({
+    count = await emails.acount()
+    if since is not None:
+        emails = emails.filter(received_at__gt=since)
+    rows = emails.values_list("id", "sender", "subject", "received_at")[:50]
+
+    return _conditional(JsonResponse({
         "expired": False,
-        "count": mailbox.emails.count(),
+        "count": count,
         "emails": [
             {
-                "id": e.id,
-                "sender": e.sender,
-                "subject": e.subject,
-                "received_at": e.received_at.isoformat(),
+                "id": pk,
+                "sender": sender,
+                "subject": subject,
+                "received_at": received_at.isoformat(),
             }
-            for e in emails[:50]
+            async for pk, sender, subject, received_at in rows
         ],
-    })
+    }), etag)
+
+
+def _close_connection():
+    connection.close()
+
+
+async def _event_stream(token, expires_at):
+    async with events.hub.subscribe(token) as queue:
+        yield "retry: 5000\n\n"
+        while True:
+            remaining = (expires_at - timezone.now()).total_seconds()
+            if remaining <= 0:
+                yield "event: expired\ndata: {}\n\n"
+                return
+            try:
+                payload = await asyncio.wait_for(queue.get(), min(events.KEEPALIVE_SECONDS, remaining))
+            except TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: email\ndata: {payload}\n\n"
+
+
+async def email_events(request, token):
+    """Server-Sent Events stream announcing new emails for a mailbox."""
+    mailbox = await Mailbox.objects.filter(token=token).only("id", "expires_at").afirst()
+    # The stream can stay open until the mailbox expires; don't hold a DB connection for it
+    await sync_to_async(_close_connection)()
+    expires_at = mailbox.expires_at if mailbox is not None else None
+    if expires_at is None and settings.LAZY_MAILBOXES:
+        signed = lazy_mailboxes.parse_token(token)
+        if signed is not None:
+            _, _, expires_at = signed
+    if expires_at is None:
+        raise Http404("No mailbox matches the given query.")
+    return StreamingHttpResponse(
+        _event_stream(token, expires_at),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @require_POST
-def new_mailbox(request):
+async def new_mailbox(request):
     """Create a fresh mailbox and redirect."""
-    domain_id = request.POST.get("domain")
-    if domain_id:
-        domain = get_object_or_404(Domain, id=domain_id, is_active=True)
-        mailbox = Mailbox.objects.create(domain=domain)
-    else:
-        domain = Domain.objects.filter(is_active=True, is_default=True).first() or Domain.objects.filter(is_active=True).first()
-        mailbox = Mailbox.objects.create(domain=domain)
+    mailbox = await _new_mailbox(await _get_domain(request.POST.get("domain")))
     return redirect("inbox:inbox_view", token=mailbox.token)
 
 
-def email_detail(request, pk):
+async def email_detail(request, pk):
     """View a single email."""
-    email = get_object_or_404(Email, pk=pk, is_deleted=False)
-    mailbox = email.mailbox
-    return render(request, "inbox/email_detail.html", {
+    found = await page_cache.aget_email(pk)
+    if found is None:
+        raise Http404("No Email matches the given query.")
+    email, mailbox, attachments = found
+    # Bodies are read by the template only when its cached fragment is missing
+    return await _render(request, "inbox/email_detail.html", {
         "email": email,
         "mailbox": mailbox,
+        "attachments": attachments,
+        "cache_timeout": page_cache.timeout_for(mailbox.expires_at),
     })
 
 
+async def _read_chunks(f, chunk_size=FileResponse.block_size):
+    read = sync_to_async(f.read, thread_sensitive=False)
+    try:
+        while chunk := await read(chunk_size):
+            yield chunk
+    finally:
+        await sync_to_async(f.close, thread_sensitive=False)()
+
+
+def _download(f, filename, content_type, size):
+    # Not a FileResponse: ASGI would read a file iterated synchronously into
+    # memory whole, and measuring a compressed blob by seeking to its end
+    # decompresses all of it. Stream from a thread with the stored size instead.
+    response = StreamingHttpResponse(_read_chunks(f), content_type=content_type)
+    response.headers["Content-Disposition"] = content_disposition_header(True, filename)
+    if size:
+        response.headers["Content-Length"] = size
+    return response
+
+
+async def email_source(request, pk):
+    """Download the raw message as an .eml file, streamed from blob storage."""
+    found = await page_cache.aget_email(pk)
+    if found is None:
+        raise Http404("No Email matches the given query.")
+    email, _, _ = found
+    if not email.raw_blob:
+        raise Http404("Message source not available")
+    f = await sync_to_async(blobs.open_blob, thread_sensitive=False)(email.raw_blob)
+    return _download(f, f"voidmail-{email.pk}.eml", "message/rfc822", email.size_bytes)
+
+
+async def attachment_download(request, pk, attachment_id):
+    """Download an attachment, streamed from blob storage."""
+    found = await page_cache.aget_email(pk)
+    if found is None:
+        raise Http404("No Email matches the given query.")
+    _, _, attachments = found
+    attachment = next((attachment for attachment in attachments if attachment.id == attachment_id), None)
+    if attachment is None:
+        raise Http404("No Attachment matches the given query.")
+    f = await sync_to_async(blobs.open_blob, thread_sensitive=False)(attachment.blob)
+    # Always a download: the content type is whatever the sender claimed
+    return _download(f, attachment.filename, attachment.content_type, attachment.size_bytes)
+
+
 @require_POST
-def delete_email(request, pk):
+async def delete_email(request, pk):
     """Soft delete a single email (mark as hidden) and redirect back to inbox."""
-    email = get_object_or_404(Email, pk=pk)
+    email = await aget_object_or_404(Email.objects.select_related("mailbox"), pk=pk)
     mailbox = email.mailbox
-    email.is_deleted = True
-    email.save()
+    # Conditional update so a repeated delete doesn't count twice
+    if await Email.objects.filter(pk=pk, is_deleted=False).aupdate(is_deleted=True):
+        await sync_to_async(mailbox_versions.record_changes)({mailbox.token: (-1, None)})
+        await sync_to_async(page_cache.invalidate_email)(pk)
     return redirect("inbox:inbox_view", token=mailbox.token)
 
 
-def health_check(request):
+async def health_check(request):
     """Health check endpoint."""
     return JsonResponse({"status": "ok"})
+
+
+async def metrics_view(request):
+    """Prometheus metrics of this web worker, or of all workers in multiprocess mode."""
+    body, content_type = await sync_to_async(metrics.render, thread_sensitive=False)()
+    return HttpResponse(body, content_type=content_type)